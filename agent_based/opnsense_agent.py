@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from cmk.agent_based.v2 import (
+    AgentSection,
+    CheckPlugin,
+    CheckResult,
+    DiscoveryResult,
+    Result,
+    Service,
+    State,
+)
+from cmk_addons.plugins.opnsense.lib.utils import parse_json, JSONSection
+
+
+agent_section_opnsense_agent = AgentSection(
+    name='opnsense_agent',
+    parse_function=parse_json,
+)
+
+
+def discovery_opnsense_agent(section: JSONSection) -> DiscoveryResult:
+    if section is not None:
+        yield Service()
+
+
+def check_opnsense_agent(section: JSONSection) -> CheckResult:
+    errors = section.get('errors', {})
+    if not errors:
+        yield Result(state=State.OK, summary='All sections fetched')
+
+    for part, error in errors.items():
+        yield Result(state=State.CRIT, summary=f"Section {part} failed", details=f"Section {part} failed: {error}")
+
+
+check_plugin_opnsense_agent = CheckPlugin(
+    name='opnsense_agent',
+    service_name='OPNsense Agent',
+    discovery_function=discovery_opnsense_agent,
+    check_function=check_opnsense_agent,
+)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from cmk.agent_based.v2 import (
+    AgentSection,
+    check_levels,
+    CheckPlugin,
+    CheckResult,
+    DiscoveryResult,
+    Result,
+    Service,
+    State,
+    render,
+)
+from cmk_addons.plugins.opnsense.lib.utils import parse_json, JSONSection
+
+
+agent_section_opnsense_agent_stats = AgentSection(
+    name='opnsense_agent_stats',
+    parse_function=parse_json,
+)
+
+
+def discovery_opnsense_agent_stats(section: JSONSection) -> DiscoveryResult:
+    if section:
+        yield Service()
+
+
+def check_opnsense_agent_stats(params: dict, section: JSONSection) -> CheckResult:
+    yield from check_levels(
+        value=section['wall_time'],
+        levels_upper=params.get('runtime', None),
+        metric_name='opnsense_agent_runtime',
+        render_func=render.timespan,
+        label='Runtime',
+    )
+    yield from check_levels(
+        value=section['cpu_time'],
+        metric_name='opnsense_agent_cpu_time',
+        render_func=render.timespan,
+        label='CPU time',
+    )
+
+    endpoints = section.get('endpoints', {})
+    yield from check_levels(
+        value=sum(e['requests'] for e in endpoints.values()),
+        metric_name='opnsense_agent_requests',
+        render_func=str,
+        label='Requests',
+    )
+    yield from check_levels(
+        value=sum(e['bytes'] for e in endpoints.values()),
+        metric_name='opnsense_agent_received',
+        render_func=render.bytes,
+        label='Received',
+    )
+
+    if 'concurrency' in section:
+        concurrency = section['concurrency']
+        yield Result(
+            state=State.OK,
+            notice=(
+                f"Adaptive concurrency: {concurrency['limit']} of {concurrency['maximum']} requests "
+                f"(peak {concurrency['peak']}, decreased {concurrency['decreases']} times)"
+            ),
+        )
+
+    for part, seconds in sorted(section.get('sections', {}).items()):
+        yield from check_levels(
+            value=seconds,
+            levels_upper=params.get('section_time', None),
+            metric_name=f"opnsense_agent_section_{part}",
+            render_func=render.timespan,
+            label=f"Section {part}",
+            notice_only=True,
+        )
+
+    for endpoint, stats in sorted(endpoints.items(), key=lambda e: e[1]['seconds'], reverse=True):
+        status = ', '.join(f"{code}: {count}" for code, count in sorted(stats['status'].items()))
+        yield Result(
+            state=State.OK,
+            notice=(
+                f"{endpoint}: {stats['requests']} requests in {render.timespan(stats['seconds'])} "
+                f"(max {render.timespan(stats['max_seconds'])}), {render.bytes(stats['bytes'])}, "
+                f"{stats['pages']} pages, {stats['cached']} cached, status {status or 'none'}"
+            ),
+        )
+
+
+check_plugin_opnsense_agent_stats = CheckPlugin(
+    name='opnsense_agent_stats',
+    service_name='OPNsense Agent Performance',
+    discovery_function=discovery_opnsense_agent_stats,
+    check_function=check_opnsense_agent_stats,
+    check_default_parameters={},
+    check_ruleset_name='opnsense_agent_stats',
+)
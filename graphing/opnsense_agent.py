@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from cmk.graphing.v1 import graphs, metrics, perfometers, Title
+
+metric_opnsense_agent_runtime = metrics.Metric(
+    name='opnsense_agent_runtime',
+    title=Title('Agent Runtime'),
+    unit=metrics.Unit(metrics.TimeNotation()),
+    color=metrics.Color.BLUE,
+)
+
+metric_opnsense_agent_cpu_time = metrics.Metric(
+    name='opnsense_agent_cpu_time',
+    title=Title('Agent CPU Time'),
+    unit=metrics.Unit(metrics.TimeNotation()),
+    color=metrics.Color.ORANGE,
+)
+
+metric_opnsense_agent_requests = metrics.Metric(
+    name='opnsense_agent_requests',
+    title=Title('Agent API Requests'),
+    unit=metrics.Unit(metrics.DecimalNotation(""), metrics.StrictPrecision(0)),
+    color=metrics.Color.GREEN,
+)
+
+metric_opnsense_agent_received = metrics.Metric(
+    name='opnsense_agent_received',
+    title=Title('Agent API Bytes Received'),
+    unit=metrics.Unit(metrics.IECNotation("B")),
+    color=metrics.Color.PURPLE,
+)
+
+metric_opnsense_agent_section_firewall = metrics.Metric(
+    name='opnsense_agent_section_firewall',
+    title=Title('Section Firewall Time'),
+    unit=metrics.Unit(metrics.TimeNotation()),
+    color=metrics.Color.BLUE,
+)
+
+metric_opnsense_agent_section_firmware = metrics.Metric(
+    name='opnsense_agent_section_firmware',
+    title=Title('Section Firmware Time'),
+    unit=metrics.Unit(metrics.TimeNotation()),
+    color=metrics.Color.GREEN,
+)
+
+metric_opnsense_agent_section_vip = metrics.Metric(
+    name='opnsense_agent_section_vip',
+    title=Title('Section VIP Time'),
+    unit=metrics.Unit(metrics.TimeNotation()),
+    color=metrics.Color.ORANGE,
+)
+
+metric_opnsense_agent_section_gateway = metrics.Metric(
+    name='opnsense_agent_section_gateway',
+    title=Title('Section Gateway Time'),
+    unit=metrics.Unit(metrics.TimeNotation()),
+    color=metrics.Color.PURPLE,
+)
+
+metric_opnsense_agent_section_ipsec = metrics.Metric(
+    name='opnsense_agent_section_ipsec',
+    title=Title('Section IPSec Time'),
+    unit=metrics.Unit(metrics.TimeNotation()),
+    color=metrics.Color.RED,
+)
+
+metric_opnsense_agent_section_unbound = metrics.Metric(
+    name='opnsense_agent_section_unbound',
+    title=Title('Section Unbound Time'),
+    unit=metrics.Unit(metrics.TimeNotation()),
+    color=metrics.Color.YELLOW,
+)
+
+metric_opnsense_agent_section_snapshot = metrics.Metric(
+    name='opnsense_agent_section_snapshot',
+    title=Title('Section Snapshot Time'),
+    unit=metrics.Unit(metrics.TimeNotation()),
+    color=metrics.Color.BROWN,
+)
+
+metric_opnsense_agent_section_ssl = metrics.Metric(
+    name='opnsense_agent_section_ssl',
+    title=Title('Section SSL Time'),
+    unit=metrics.Unit(metrics.TimeNotation()),
+    color=metrics.Color.PINK,
+)
+
+graph_opnsense_agent_runtime = graphs.Graph(
+    name='opnsense_agent_runtime',
+    title=Title('Agent Runtime'),
+    simple_lines=[
+        'opnsense_agent_runtime',
+        'opnsense_agent_cpu_time',
+    ],
+)
+
+graph_opnsense_agent_sections = graphs.Graph(
+    name='opnsense_agent_sections',
+    title=Title('Agent Section Times'),
+    compound_lines=[
+        'opnsense_agent_section_firewall',
+        'opnsense_agent_section_firmware',
+        'opnsense_agent_section_vip',
+        'opnsense_agent_section_gateway',
+        'opnsense_agent_section_ipsec',
+        'opnsense_agent_section_unbound',
+        'opnsense_agent_section_snapshot',
+        'opnsense_agent_section_ssl',
+    ],
+    optional=[
+        'opnsense_agent_section_firewall',
+        'opnsense_agent_section_firmware',
+        'opnsense_agent_section_vip',
+        'opnsense_agent_section_gateway',
+        'opnsense_agent_section_ipsec',
+        'opnsense_agent_section_unbound',
+        'opnsense_agent_section_snapshot',
+        'opnsense_agent_section_ssl',
+    ],
+)
+
+perfometer_opnsense_agent_runtime = perfometers.Perfometer(
+    name='opnsense_agent_runtime',
+    focus_range=perfometers.FocusRange(
+        perfometers.Closed(0),
+        perfometers.Open(60),
+    ),
+    segments=['opnsense_agent_runtime'],
+)
@@ -19,46 +19,252 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
+# The agent is started once per host and check interval, so modules only
+# needed on some code paths (requests, the thread pools, the cache and the
+# collector daemon) are imported where they are used.
+
 from typing import Optional, Sequence
+import io
+import json
 import logging
-import requests
-from functools import cached_property
-from json import JSONDecodeError
+import math
+import os
+import sys
+import threading
+import time
+from argparse import ArgumentError, ArgumentTypeError
+from collections import deque
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
+from copy import copy
+from contextvars import ContextVar, copy_context
+from functools import cached_property, lru_cache
+from itertools import chain
 
 from cmk.special_agents.v0_unstable.agent_common import (
     CannotRecover,
+    ConditionalPiggybackSection,
     SectionWriter,
     special_agent_main,
 )
 from cmk.special_agents.v0_unstable.argument_parsing import Args, create_default_argument_parser
 
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
 LOGGING = logging.getLogger('agent_opnsense')
 
+# Monotonic point in time by which the requests of the current section must be done
+DEADLINE: ContextVar[Optional[float]] = ContextVar('DEADLINE', default=None)
+# Part whose section is being fetched, for the request spans
+PART: ContextVar[Optional[str]] = ContextVar('PART', default=None)
+
+
+@lru_cache(maxsize=None)
+def _requests():
+    import requests
+    import urllib3
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    return requests
+
+
+def parse_positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise ArgumentTypeError(f"must be at least 1, not {number}")
+    return number
+
+
+def parse_section_seconds(value):
+    part, _, seconds = value.partition('=')
+    if part not in AgentOpnSense.PARTS:
+        raise ArgumentTypeError(f"unknown section {part!r}")
+    seconds = float(seconds)
+    if not seconds >= 0:
+        raise ArgumentTypeError(f"seconds of {part!r} must not be negative, not {seconds:g}")
+    return part, seconds
+
+
+def parse_cache_ttl(value):
+    part, _, seconds = value.partition('=')
+    if part not in AgentOpnSense.CACHEABLE:
+        raise ArgumentTypeError(f"section {part!r} can not be cached")
+    return part, float(seconds)
+
+
+def parse_page_size(value):
+    command, _, rows = value.rpartition('=')
+    if command and command not in AgentOpnSense.SEARCHES:
+        raise ArgumentTypeError(f"unknown search command {command!r}")
+    rows = int(rows)
+    if rows == 0 or rows < -1:
+        raise ArgumentTypeError(f"page size must be -1 or at least 1, not {rows}")
+    return command or None, rows
+
 
 class OSAPI:
-    def __init__(self, url, key, secret, timeout=None, verify_cert=True):
+    def __init__(self, url, key, secret, timeout=None, connect_timeout=None, verify_cert=True, pool_size=1, session=None, pager=None, page_fanout=1, page_size=None, cache=None, cache_ttl=None, ipsec_child='connection', tracer=None, record=None, replay=None, replay_latency=0.0, rate_limit=None, rate_burst=None, max_in_flight=None, adaptive=False):
         self._url = url.rstrip('/')
         self._key = key
         self._secret = secret
         self._verify_cert = verify_cert
+        self._pool_size = pool_size
+        self._session = session
         self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.page_fanout = page_fanout
+        self.page_size = page_size or {}
+        self.cache = cache
+        self.cache_ttl = cache_ttl or {}
+        self.ipsec_child = ipsec_child
+        self.tracer = tracer
+        self.record = record
+        self.replay = replay
+        self.replay_latency = replay_latency
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        if pager is not None:
+            self._pager = pager
+        self.bucket = None
+        if rate_limit:
+            from cmk_addons.plugins.opnsense.lib.throttle import TokenBucket
+            self.bucket = TokenBucket(rate_limit, rate_burst or 1)
+        self.in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        self.adaptive = None
+        if adaptive:
+            from cmk_addons.plugins.opnsense.lib.throttle import AdaptiveLimit
+            self.in_flight = self.adaptive = AdaptiveLimit(max_in_flight or pool_size * max(page_fanout, 1))
 
     @cached_property
     def _cli(self):
-        sess = requests.Session()
+        requests = _requests()
+        sess = self._session or requests.Session()
         sess.auth = (self._key, self._secret)
+        pool_size = self._pool_size * max(self.page_fanout, 1)
+        if self.replay:
+            kind = ('replay', self.replay, self.replay_latency)
+        elif self.record:
+            kind = ('record', self.record, pool_size)
+        elif pool_size > requests.adapters.DEFAULT_POOLSIZE:
+            kind = ('pool', pool_size)
+        else:
+            kind = None
+        # Sessions kept across daemon cycles keep their adapter and its pooled connections
+        if getattr(sess, 'opnsense_adapter', None) != kind:
+            self._mount(sess, kind)
         return sess
 
+    def _mount(self, sess, kind):
+        '''Mount the adapter of kind on a session and close the adapters it replaces'''
+        requests = _requests()
+        if kind is None:
+            adapter = requests.adapters.HTTPAdapter()
+        elif kind[0] == 'replay':
+            from cmk_addons.plugins.opnsense.lib.replay import ReplayAdapter
+            adapter = ReplayAdapter(kind[1], kind[2])
+        elif kind[0] == 'record':
+            from cmk_addons.plugins.opnsense.lib.replay import RecordingAdapter
+            adapter = RecordingAdapter(kind[1], kind[2])
+        else:
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=kind[1])
+        replaced = {sess.adapters[prefix] for prefix in ['http://', 'https://'] if prefix in sess.adapters}
+        sess.mount('http://', adapter)
+        sess.mount('https://', adapter)
+        for old in replaced:
+            old.close()
+        sess.opnsense_adapter = kind
+
+    def _timeout(self, method, url):
+        read_timeout = self.timeout
+        deadline = DEADLINE.get()
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise CannotRecover(f"Deadline exceeded before trying to {method} {url}")
+            read_timeout = remaining if read_timeout is None else min(read_timeout, remaining)
+        connect_timeout = self.connect_timeout
+        if connect_timeout is None or (read_timeout is not None and read_timeout < connect_timeout):
+            connect_timeout = read_timeout
+        return connect_timeout, read_timeout
+
+    @cached_property
+    def cache_owner(self):
+        '''Digest of the credentials in the cache keys, other credentials must not read the entries'''
+        from cmk_addons.plugins.opnsense.lib.cache import credentials_digest
+        return credentials_digest(self._key, self._secret)
+
+    def _cache_lookup(self, method, endpoint, payload):
+        '''Return the cache key and the cached data of an endpoint, the key is None if it is not cached'''
+        ttl = self.cache_ttl.get(endpoint)
+        if self.cache is None or not ttl:
+            return None, None
+        url = f"{self._url}/{endpoint}"
+        key = (self.cache_owner, method, url, payload)
+        data = self.cache.get(*key, ttl=ttl)
+        if data is not None:
+            LOGGING.debug(f">> {method} {url} (cached)")
+            with self._stats_lock:
+                self._stats(endpoint)['cached'] += 1
+        return key, data
+
+    def prepare(self):
+        '''Build the session and the page pool before threads share the API, cached_property does not lock'''
+        self._cli
+        if self.page_fanout > 1:
+            self._pager
+
     def request(self, method, module, controller, command, **kwargs):
-        url = f"{self._url}/{module}/{controller}/{command}"
+        endpoint = f"{module}/{controller}/{command}"
+        key, data = self._cache_lookup(method, endpoint, kwargs.get('json'))
+        if data is not None:
+            return data
+
+        data = self._request(method, f"{self._url}/{endpoint}", **kwargs)
+        if key is not None:
+            self.cache.set(*key, data=data)
+        return data
+
+    @contextmanager
+    def _throttle(self, method, url):
+        '''Wait for a free slot of max_in_flight and a token of the rate limit within the deadline'''
+        if self.in_flight is None and self.bucket is None:
+            yield
+            return
+        deadline = DEADLINE.get()
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        started = time.perf_counter()
+        if self.in_flight is not None and not self.in_flight.acquire(timeout=remaining):
+            raise CannotRecover(f"Deadline exceeded waiting for a free request slot to {method} {url}")
+        try:
+            if self.bucket is not None:
+                wait = self.bucket.reserve()
+                if deadline is not None and time.monotonic() + wait > deadline:
+                    self.bucket.refund()
+                    raise CannotRecover(f"Deadline exceeded waiting for the rate limit to {method} {url}")
+                if wait > 0:
+                    LOGGING.debug(f"Rate limit delays {method} {url} by {wait:.3f}s")
+                    time.sleep(wait)
+            waited = time.perf_counter() - started
+            if self.tracer is not None and waited > 0.001:
+                self.tracer.complete(f"wait {url.removeprefix(f'{self._url}/')}", 'throttle', started, waited, url=url, part=PART.get())
+            yield
+        finally:
+            if self.in_flight is not None:
+                self.in_flight.release()
+
+    def _request(self, method, url, **kwargs):
         LOGGING.debug(f">> {method} {url}")
+        with self._throttle(method, url):
+            return self._send(method, url, **kwargs)
+
+    def _send(self, method, url, **kwargs):
+        timeout = self._timeout(method, url)
+        requests = _requests()
+        from cmk_addons.plugins.opnsense.lib.decoder import JSONDecodeError
+        started, status, size = time.perf_counter(), None, 0
         try:
-            resp = self._cli.request(method, url, verify=self._verify_cert, timeout=self.timeout, **kwargs)
+            resp = self._cli.request(method, url, verify=self._verify_cert, timeout=timeout, stream=True, **kwargs)
+            status = resp.status_code
+            content = self._read(resp, timeout[1])
+            size = len(content)
             resp.raise_for_status()
-            return resp.json()
+            return self._decode(content)
         except requests.exceptions.HTTPError as exc:
             if exc.response.status_code == 401:
                 raise CannotRecover(f"Could not authenticate to {url}. Key or secret is incorrect.") from exc
@@ -66,11 +272,88 @@ class OSAPI:
                 raise CannotRecover(f"Not permited to access {url}.") from exc
             raise CannotRecover(f"Request error {exc.response.status_code} when trying to {method} {url}") from exc
         except requests.exceptions.ReadTimeout as exc:
-            raise CannotRecover(f"Read timeout after {self.timeout}s when trying to {method} {url}") from exc
+            raise CannotRecover(f"Read timeout after {timeout[1]:g}s when trying to {method} {url}") from exc
+        except requests.exceptions.ConnectTimeout as exc:
+            raise CannotRecover(f"Connect timeout after {timeout[0]:g}s when trying to {method} {url}") from exc
         except requests.exceptions.ConnectionError as exc:
             raise CannotRecover(f"Could not {method} {url} ({exc})") from exc
+        except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ContentDecodingError) as exc:
+            raise CannotRecover(f"Could not read the response of {url} ({exc})") from exc
         except JSONDecodeError as exc:
             raise CannotRecover(f"Couldn't parse JSON at {url}") from exc
+        finally:
+            duration = time.perf_counter() - started
+            endpoint = url.removeprefix(f"{self._url}/")
+            self._record(endpoint, duration, status, size)
+            if self.adaptive is not None:
+                self.adaptive.observe(endpoint, started, duration, status)
+            if self.tracer is not None:
+                page = (kwargs.get('json') or {}).get('current')
+                self.tracer.complete(f"{method} {endpoint}", 'request', started, duration, url=url, status=status, bytes=size, page=page, part=PART.get())
+
+    @staticmethod
+    def _read(resp, read_timeout):
+        '''Return the body of a streamed response
+
+        The read timeout of requests applies to every read from the
+        socket, a firewall trickling the body could hold a request far
+        longer. The whole body has to arrive within the read timeout.
+        Only read1 of urllib3 2 returns what arrived without waiting for
+        a full chunk, other responses, like replayed ones, are read with
+        iter_content and bounded between chunks.
+        '''
+        requests = _requests()
+        from urllib3.exceptions import DecodeError, ProtocolError, ReadTimeoutError
+        read1 = getattr(resp.raw, 'read1', None)
+        if read1 is not None:
+            pieces = iter(lambda: read1(65536, decode_content=True), b'')
+        else:
+            pieces = resp.iter_content(65536)
+        limit = None if read_timeout is None else time.monotonic() + read_timeout
+        chunks = []
+        try:
+            for chunk in pieces:
+                chunks.append(chunk)
+                if limit is not None and time.monotonic() > limit:
+                    raise requests.exceptions.ReadTimeout(f"Body not received within {read_timeout:g}s", response=resp)
+        except ProtocolError as exc:
+            resp.close()
+            raise requests.exceptions.ChunkedEncodingError(exc) from exc
+        except DecodeError as exc:
+            resp.close()
+            raise requests.exceptions.ContentDecodingError(exc) from exc
+        except ReadTimeoutError as exc:
+            resp.close()
+            raise requests.exceptions.ReadTimeout(exc, response=resp) from exc
+        except BaseException:
+            resp.close()
+            raise
+        return b''.join(chunks)
+
+    @staticmethod
+    def _decode(content):
+        '''Parse a JSON body, invalid UTF-8 is replaced like requests did'''
+        from cmk_addons.plugins.opnsense.lib.decoder import get_loads
+        loads = get_loads()
+        try:
+            return loads(content)
+        except ValueError:
+            # Both decoders reject invalid UTF-8 in bytes, with UnicodeDecodeError or JSONDecodeError
+            return loads(content.decode('utf-8', errors='replace'))
+
+    def _stats(self, endpoint):
+        return self.stats.setdefault(endpoint, dict(requests=0, cached=0, pages=0, seconds=0.0, max_seconds=0.0, bytes=0, status={}))
+
+    def _record(self, endpoint, seconds, status, size):
+        '''Account a request to an endpoint in stats, status is None for requests without a response'''
+        with self._stats_lock:
+            stats = self._stats(endpoint)
+            stats['requests'] += 1
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            stats['bytes'] += size
+            status = 'error' if status is None else str(status)
+            stats['status'][status] = stats['status'].get(status, 0) + 1
 
     def get(self, module, controller, command, **kwargs):
         return self.request('GET', module, controller, command, **kwargs)
@@ -79,73 +362,125 @@ class OSAPI:
         return self.request('POST', module, controller, command, **kwargs)
 
     @cached_property
-    def getVipStatus(self):
-        vips = []
-        carp = None
-        current = 1
-        while True:
-            page = self.post('diagnostics', 'interface', 'get_vip_status', json=dict(current=current))
-            vips.extend(page['rows'])
-            carp = page['carp']
-            if page['total'] <= (page['rowCount'] * (page['current'] + 1)):
-                break
-            current = current + 1
-        return dict(vips=vips, carp=carp)
+    def _pager(self):
+        from concurrent.futures import ThreadPoolExecutor
+        return ThreadPoolExecutor(max_workers=self.page_fanout, thread_name_prefix='agent_opnsense_page')
+
+    def paginate(self, module, controller, command, **payload):
+        '''Yield all pages of a search endpoint in order.
+
+        The first page tells how many pages there are. The remaining pages
+        are prefetched with up to page_fanout requests in flight. The page
+        size is taken from page_size by command name, falling back to the
+        None key and then to the server default. A size of -1 fetches all
+        rows in one request. Cached searches are stored with all of their
+        pages in one entry, so a result never combines pages of different
+        age.
+        '''
+        page_size = self.page_size.get(command, self.page_size.get(None))
+        if page_size is not None:
+            payload['rowCount'] = page_size
+
+        key, pages = self._cache_lookup('POST', f"{module}/{controller}/{command}", payload)
+        if pages is not None:
+            yield from pages
+            return
+        if key is None:
+            yield from self._paginate(module, controller, command, payload)
+            return
+
+        pages = []
+        for page in self._paginate(module, controller, command, payload):
+            pages.append(page)
+            yield page
+        self.cache.set(*key, data=pages)
+
+    def _paginate(self, module, controller, command, payload):
+        url = f"{self._url}/{module}/{controller}/{command}"
+        page = self._request('POST', url, json=dict(payload, current=1))
+        yield page
+
+        pages = math.ceil(page['total'] / page['rowCount']) if page['rowCount'] > 0 else 1
+        with self._stats_lock:
+            self._stats(f"{module}/{controller}/{command}")['pages'] += pages
+        if self.page_fanout <= 1:
+            for current in range(2, pages + 1):
+                yield self._request('POST', url, json=dict(payload, current=current))
+            return
+
+        futures = deque()
+        try:
+            for current in range(2, pages + 1):
+                futures.append(self._pager.submit(copy_context().run, self._request, 'POST', url, json=dict(payload, current=current)))
+                if len(futures) >= self.page_fanout:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def search(self, module, controller, command, **payload):
+        '''Yield the rows of a search endpoint as the pages arrive.'''
+        for page in self.paginate(module, controller, command, **payload):
+            yield from page['rows']
 
     def getIpsecChild(self, connection):
-        child = []
-        current = 1
-        while True:
-            page = self.post('ipsec', 'connections', 'search_child', json=dict(connection=connection, current=current))
-            child.extend(c for c in page['rows'] if c['enabled'] == "1")
-            if page['total'] <= (page['rowCount'] * (page['current'] + 1)):
-                break
-            current = current + 1
+        return [
+            c
+            for c in self.search('ipsec', 'connections', 'search_child', connection=connection)
+            if c['enabled'] == "1"
+        ]
+
+    @cached_property
+    def getIpsecChilds(self):
+        child = {}
+        for c in self.search('ipsec', 'connections', 'search_child'):
+            if c['enabled'] == "1":
+                child.setdefault(c['connection'], []).append(c)
         return child
 
     @cached_property
     def getIpsecConnections(self):
         conn = []
-        current = 1
-        while True:
-            page = self.post('ipsec', 'connections', 'search_connection', json=dict(current=current))
-            for c in page['rows']:
-                if c['enabled'] != "1":
-                    continue
+        for c in self.search('ipsec', 'connections', 'search_connection'):
+            if c['enabled'] != "1":
+                continue
+            if self.ipsec_child == 'connection':
                 c['child'] = self.getIpsecChild(c['uuid'])
-                conn.append(c)
-            if page['total'] <= (page['rowCount'] * (page['current'] + 1)):
-                break
-            current = current + 1
-        return conn
-
-    @cached_property
-    def getIpsecPhase1(self):
-        conn = []
-        current = 1
-        while True:
-            page = self.post('ipsec', 'sessions', 'search_phase1', json=dict(current=current))
-            conn.extend(page['rows'])
-            if page['total'] <= (page['rowCount'] * (page['current'] + 1)):
-                break
-            current = current + 1
+            elif self.ipsec_child == 'bulk':
+                c['child'] = self.getIpsecChilds.get(c['uuid'], [])
+            conn.append(c)
         return conn
 
     def getIpsecPhase2(self, id):
-        conn = []
-        current = 1
-        while True:
-            page = self.post('ipsec', 'sessions', 'search_phase2', json=dict(id=id, current=current))
-            conn.extend(c for c in page['rows'] if c['state'] == 'INSTALLED')
-            if page['total'] <= (page['rowCount'] * (page['current'] + 1)):
-                break
-            current = current + 1
-        return conn
+        return [
+            c
+            for c in self.search('ipsec', 'sessions', 'search_phase2', id=id)
+            if c['state'] == 'INSTALLED'
+        ]
 
 
 class AgentOpnSense:
     '''Checkmk special Agent for OpnSense'''
 
+    pager = None
+    session = None
+    tracer = None
+
+    PARTS = ['firewall', 'firmware', 'vip', 'gateway', 'ipsec', 'unbound', 'snapshot', 'ssl']
+    # Characters of a part buffered in memory before they are spooled to disk
+    SPOOL_SIZE = 256 * 1024
+    # Paginated search commands which take a page size
+    SEARCHES = ['get_vip_status', 'search_connection', 'search_child', 'search_phase1', 'search_phase2']
+    # Endpoints of rarely changing data which may be served from the cache
+    CACHEABLE = {
+        'firmware': ['core/firmware/status'],
+        'ipsec': ['ipsec/connections/search_connection', 'ipsec/connections/search_child'],
+        'snapshot': ['core/snapshots/search'],
+        'ssl': ['trust/cert/search'],
+    }
+
     def run(self, args=None):
         return special_agent_main(self.parse_arguments, self.main, args)
 
@@ -154,22 +489,50 @@ class AgentOpnSense:
 
         parser.add_argument('-U', '--url',
                             dest='url',
-                            required=True,
                             help='Base-URL of the SmartZone Public API. (ex: https://opnsense.local/api/)')
         parser.add_argument('-k', '--key',
                             dest='key',
-                            required=True,
                             help='OpnSense API key.')
         parser.add_argument('-s', '--secret',
                             dest='secret',
-                            required=True,
                             help='OpnSense API secret.')
+        parser.add_argument('--collect',
+                            dest='collect',
+                            metavar='FILE',
+                            help='Poll all firewalls listed in the JSON file FILE and write their sections as piggyback data. '
+                                 'Each entry needs host, url, key and secret and may add agent arguments as args.')
+        parser.add_argument('--daemon',
+                            dest='daemon',
+                            metavar='SOCKET',
+                            help='Keep polling the firewalls of --collect and serve their latest output on the Unix socket SOCKET.')
+        parser.add_argument('--interval',
+                            dest='interval',
+                            type=float,
+                            default=60,
+                            help='Polling interval of --daemon in seconds. (Default: 60)')
         parser.add_argument('-t', '--timeout',
                             dest='timeout',
-                            type=int,
+                            type=float,
                             required=False,
                             default=10,
-                            help='HTTP connection timeout. (Default: 10)')
+                            help='HTTP read timeout, the whole response body has to arrive within it. (Default: 10)')
+        parser.add_argument('--connect-timeout',
+                            dest='connect_timeout',
+                            type=float,
+                            required=False,
+                            help='HTTP connect timeout. (Default: same as --timeout)')
+        parser.add_argument('--deadline',
+                            dest='deadline',
+                            type=float,
+                            required=False,
+                            help='Total time budget of the run in seconds. Sections not done in time are reported as failed.')
+        parser.add_argument('--section-timeout',
+                            dest='section_timeout',
+                            type=parse_section_seconds,
+                            action='append',
+                            default=[],
+                            metavar='SECTION=SECONDS',
+                            help='Time budget for a single section like unbound=5. Can be given multiple times.')
         parser.add_argument('--ignore-cert',
                             dest='verify_cert',
                             action='store_false',
@@ -206,63 +569,586 @@ class AgentOpnSense:
                             dest='ssl',
                             action='store_true',
                             help='Fetch Certificate status')
+        parser.add_argument('--page-fanout',
+                            dest='page_fanout',
+                            type=parse_positive_int,
+                            required=False,
+                            default=1,
+                            help='Number of pages of a search fetched concurrently. (Default: 1)')
+        parser.add_argument('--page-size',
+                            dest='page_size',
+                            type=parse_page_size,
+                            action='append',
+                            default=[],
+                            metavar='[COMMAND=]ROWS',
+                            help='Rows per page for search commands like search_phase2, -1 for all rows. '
+                                 'Without COMMAND it applies to all searches. Can be given multiple times.')
+        parser.add_argument('--ipsec-child',
+                            dest='ipsec_child',
+                            choices=['connection', 'bulk', 'skip'],
+                            default='connection',
+                            help='Fetch IPSec child definitions per connection, in one bulk search or skip them. (Default: connection)')
+        parser.add_argument('--ipsec-phase2',
+                            dest='ipsec_phase2',
+                            choices=['connection', 'bulk'],
+                            default='connection',
+                            help='Fetch IPSec phase2 sessions per connection or in one bulk search. (Default: connection)')
+        parser.add_argument('--cache-dir',
+                            dest='cache_dir',
+                            help='Directory for cached API responses. '
+                                 '(Default: $OMD_ROOT/tmp/check_mk/agents/agent_opnsense)')
+        parser.add_argument('--cache-ttl',
+                            dest='cache_ttl',
+                            type=parse_cache_ttl,
+                            action='append',
+                            default=[],
+                            metavar='SECTION=SECONDS',
+                            help='Serve the API responses of firmware, ipsec (connection definitions), snapshot or ssl '
+                                 'from the cache for SECONDS. Can be given multiple times.')
+        parser.add_argument('--section-interval',
+                            dest='section_interval',
+                            type=parse_section_seconds,
+                            action='append',
+                            default=[],
+                            metavar='SECTION=SECONDS',
+                            help='Fetch a section like firmware=86400 only once per interval and '
+                                 'reuse the last result with a cached header in between. Can be given multiple times.')
+        parser.add_argument('--workers',
+                            dest='workers',
+                            type=parse_positive_int,
+                            required=False,
+                            default=1,
+                            help='Number of sections, or firewalls with --collect, fetched concurrently. (Default: 1)')
+        parser.add_argument('--rate-limit',
+                            dest='rate_limit',
+                            type=float,
+                            metavar='RATE',
+                            help='Send at most RATE API requests per second to a firewall.')
+        parser.add_argument('--rate-burst',
+                            dest='rate_burst',
+                            type=int,
+                            metavar='N',
+                            help='Allow N requests at once after a pause within --rate-limit. (Default: 1)')
+        parser.add_argument('--max-in-flight',
+                            dest='max_in_flight',
+                            type=int,
+                            metavar='N',
+                            help='Keep at most N API requests to a firewall in flight, over all --workers and --page-fanout.')
+        parser.add_argument('--adaptive-concurrency',
+                            dest='adaptive',
+                            action='store_true',
+                            help='Adapt the API requests in flight to the latency and errors of the firewall, '
+                                 'up to --max-in-flight or --workers times --page-fanout.')
+        parser.add_argument('--record',
+                            dest='record',
+                            metavar='DIR',
+                            help='Save every API request and response to DIR.')
+        parser.add_argument('--replay',
+                            dest='replay',
+                            metavar='DIR',
+                            help='Answer the API requests from the responses recorded in DIR '
+                                 'without network access. -U, -k and -s are optional.')
+        parser.add_argument('--replay-latency',
+                            dest='replay_latency',
+                            type=float,
+                            default=0.0,
+                            metavar='FACTOR',
+                            help='Wait FACTOR times the recorded response time before answering '
+                                 'a replayed request. (Default: 0)')
+        parser.add_argument('--bench',
+                            dest='bench',
+                            type=int,
+                            metavar='N',
+                            help='Fetch the enabled sections N times without caches and print the latency, '
+                                 'requests and bytes of every section and API endpoint instead of the agent output.')
+        parser.add_argument('--trace',
+                            dest='trace',
+                            metavar='FILE',
+                            help='Write a trace of the sections and API requests of the run to FILE '
+                                 'in the Chrome trace event format.')
+        parser.add_argument('--profile',
+                            dest='profile',
+                            action='store_true',
+                            help='Profile the run and write the profile to --profile-dir.')
+        parser.add_argument('--profile-dir',
+                            dest='profile_dir',
+                            help='Directory for profiles. '
+                                 '(Default: $OMD_ROOT/var/check_mk/agent_opnsense/profiles)')
+        parser.add_argument('--profile-format',
+                            dest='profile_format',
+                            choices=['pstats', 'collapsed'],
+                            default='pstats',
+                            help='Write a cProfile of the main thread or stacks of all threads sampled every 5ms '
+                                 'in collapsed format. (Default: pstats)')
+        parser.add_argument('--profile-every',
+                            dest='profile_every',
+                            type=parse_positive_int,
+                            default=1,
+                            metavar='N',
+                            help='Profile only one in N runs, chosen at random. (Default: 1)')
+
+        self.parser = parser
+        return self.check_arguments(parser.parse_args(argv))
 
-        return parser.parse_args(argv)
+    def check_arguments(self, args):
+        '''Apply the checks argparse can not express, errors exit like argparse does'''
+        parser = self.parser
+        if args.replay:
+            args.url = args.url or 'https://opnsense.replay/api/'
+            args.key = args.key or 'replay'
+            args.secret = args.secret or 'replay'
+        if args.collect is None and None in (args.url, args.key, args.secret):
+            parser.error('the following arguments are required: -U/--url, -k/--key, -s/--secret')
+        if args.daemon and args.collect is None:
+            parser.error('--daemon requires --collect')
+        if (args.rate_limit is not None and args.rate_limit <= 0) or (args.rate_burst is not None and args.rate_burst < 1) \
+                or (args.max_in_flight is not None and args.max_in_flight < 1):
+            parser.error('--rate-limit, --rate-burst and --max-in-flight need positive values')
+        if args.record and args.replay:
+            parser.error('--record and --replay can not be used together')
+        if args.daemon and (args.profile or args.trace):
+            parser.error('--profile and --trace can not be used with --daemon')
+        if args.bench is not None and (args.collect or args.bench < 1):
+            parser.error('--bench needs a positive number of runs and can not be used with --collect')
+        return args
+
+    @cached_property
+    def cache(self):
+        from cmk_addons.plugins.opnsense.lib.cache import default_cache_dir, JSONCache
+        return JSONCache(self.args.cache_dir or default_cache_dir())
 
     @cached_property
     def api(self):
-        return OSAPI(self.args.url, self.args.key, self.args.secret, timeout=self.args.timeout, verify_cert=self.args.verify_cert)
+        return OSAPI(
+            self.args.url, self.args.key, self.args.secret,
+            pager=self.pager,
+            tracer=self.tracer,
+            session=self.session,
+            timeout=self.args.timeout,
+            connect_timeout=self.args.connect_timeout,
+            verify_cert=self.args.verify_cert,
+            pool_size=self.args.workers,
+            page_fanout=self.args.page_fanout,
+            page_size=dict(self.args.page_size),
+            cache=self.cache if self.args.cache_ttl else None,
+            cache_ttl={
+                endpoint: ttl
+                for part, ttl in self.args.cache_ttl
+                for endpoint in self.CACHEABLE[part]
+            },
+            ipsec_child=self.args.ipsec_child,
+            record=self.args.record,
+            replay=self.args.replay,
+            replay_latency=self.args.replay_latency,
+            rate_limit=self.args.rate_limit,
+            rate_burst=self.args.rate_burst,
+            max_in_flight=self.args.max_in_flight,
+            adaptive=self.args.adaptive,
+        )
+
+    @property
+    def parts(self):
+        return [part for part in self.PARTS if getattr(self.args, part)]
 
     def main(self, args: Args):
         self.args = args
+        if self.args.daemon:
+            return self.main_daemon()
+        main = self.main_collect if self.args.collect else self.main_agent
+        if self.args.bench:
+            main = self.main_bench
+        if self.args.trace:
+            main = self.traced(main)
+        if self.args.profile:
+            import random
+            if random.randrange(max(self.args.profile_every, 1)) == 0:
+                return self.profile(main)
+        return main()
+
+    def traced(self, main):
+        from cmk_addons.plugins.opnsense.lib.tracing import Tracer
+
+        def run():
+            self.tracer = Tracer()
+            try:
+                with self.tracer.span('collect' if self.args.collect else 'agent', 'agent', url=self.args.url):
+                    return main()
+            finally:
+                # The trace must not fail the run it traced
+                try:
+                    self.tracer.write(self.args.trace)
+                except OSError as exc:
+                    LOGGING.error(f"Could not write trace to {self.args.trace}: {exc}")
+                else:
+                    LOGGING.info(f"Wrote trace to {self.args.trace}")
+        return run
+
+    def profile(self, main):
+        from urllib.parse import urlsplit
+        from cmk_addons.plugins.opnsense.lib.profiling import default_profile_dir, profile_call
+        name = 'collect' if self.args.collect else urlsplit(self.args.url).hostname
+        return profile_call(main, self.args.profile_dir or default_profile_dir(), f"agent_opnsense-{name}", self.args.profile_format)
+
+    def main_agent(self):
+        self.start_clock()
+
+        parts = self.parts
+        self.errors = errors = {}
+
+        if self.args.workers <= 1:
+            for part in parts:
+                try:
+                    with self.budget(part):
+                        self.write_complete(self.sections(part))
+                except CannotRecover as exc:
+                    errors[part] = exc
+        else:
+            from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+            # The workers share one API client with its limits and stats
+            self.api.prepare()
+            executor = ThreadPoolExecutor(max_workers=self.args.workers, thread_name_prefix='agent_opnsense')
+            try:
+                futures = [(part, executor.submit(self.collect, part)) for part in parts]
+                for part, future in futures:
+                    try:
+                        self.write(future.result(timeout=self.remaining()))
+                    except FutureTimeoutError:
+                        errors[part] = CannotRecover(f"Deadline of {self.args.deadline:g}s exceeded")
+                    except CannotRecover as exc:
+                        errors[part] = exc
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        if parts and len(errors) == len(parts):
+            raise next(iter(errors.values()))
+
+        self.stop_clock()
+        self.write_agent(errors)
+
+    def main_bench(self):
+        '''Run the agent args.bench times and print a report of the runs
+
+        Every run uses a new API client like a new agent process would.
+        The caches are disabled to measure the firewall.
+        '''
+        from cmk_addons.plugins.opnsense.lib.bench import report
+        from cmk_addons.plugins.opnsense.lib.tracing import Tracer
+        self.args.cache_ttl = []
+        self.args.section_interval = []
+        if self.tracer is None:
+            self.tracer = Tracer()
+        runs = []
+        with open(os.devnull, 'w') as devnull:
+            for _ in range(self.args.bench):
+                self.__dict__.pop('api', None)
+                with redirect_stdout(devnull):
+                    try:
+                        self.main_agent()
+                    except CannotRecover:
+                        self.stop_clock()
+                runs.append((self.wall_time, self.errors))
+        sys.stdout.write(report(self.args.url, runs, self.tracer.events))
+
+    def main_collect(self):
+        for hostname, agent, sections, errors in self.collect_hosts(self.host_agents()):
+            with ConditionalPiggybackSection(hostname):
+                agent.write(sections)
+                agent.write_agent(errors)
+
+    def main_daemon(self):
+        import signal
+        from cmk_addons.plugins.opnsense.lib.server import CollectorServer
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        server = CollectorServer(self.args.daemon)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        sessions = {}
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    self.daemon_cycle(server.outputs, sessions)
+                except Exception:
+                    LOGGING.exception('Collection cycle failed')
+                time.sleep(max(self.args.interval - (time.monotonic() - started), 0))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def daemon_cycle(self, outputs, sessions):
+        '''Collect all hosts once and keep their rendered output'''
+        try:
+            agents = self.host_agents()
+        except (OSError, ValueError, KeyError) as exc:
+            LOGGING.error(f"Could not read {self.args.collect}: {exc}")
+            return
+
+        for hostname, agent in agents.items():
+            agent.session = sessions.setdefault(hostname, _requests().Session())
+        for hostname in set(sessions) - set(agents):
+            sessions.pop(hostname).close()
+            outputs.pop(hostname, None)
+
+        for hostname, agent, sections, errors in self.collect_hosts(agents):
+            output = io.StringIO()
+            with redirect_stdout(output):
+                agent.write(sections)
+                agent.write_agent(errors)
+            outputs[hostname] = (time.time(), output.getvalue())
+
+    def host_agents(self):
+        '''Return the agents of the hosts in the collect file, hosts with invalid entries are logged and skipped'''
+        with open(self.args.collect) as fh:
+            hosts = json.load(fh)
+
+        agents = {}
+        for host in hosts:
+            try:
+                hostname = host['host']
+                args = self.host_arguments(host)
+            except (KeyError, TypeError, ValueError) as exc:
+                LOGGING.error(f"Skipping invalid host {host.get('host') if isinstance(host, dict) else host!r} in {self.args.collect}: {exc}")
+                continue
+            agent = AgentOpnSense()
+            agent.args = args
+            # Recordings are keyed without the host
+            for option in ['record', 'replay']:
+                if getattr(agent.args, option):
+                    setattr(agent.args, option, os.path.join(getattr(agent.args, option), hostname))
+            agents[hostname] = agent
+        return agents
+
+    def host_arguments(self, host):
+        '''Parse and check the arguments of a host in the collect file, invalid arguments raise ValueError'''
+        extra = host.get('args', [])
+        if not isinstance(extra, list) or not all(isinstance(arg, str) for arg in extra):
+            raise ValueError('args must be a list of strings')
+        argv = ['-U', host['url'], '-k', host['key'], '-s', host['secret'], *extra]
+        stderr = io.StringIO()
+        try:
+            with redirect_stderr(stderr):
+                args = self.check_arguments(self.parser.parse_args(argv, namespace=copy(self.args)))
+        except (SystemExit, ArgumentError) as exc:
+            message = stderr.getvalue().strip().splitlines()
+            raise ValueError(message[-1] if message else str(exc)) from None
+        args.collect = None
+        args.daemon = None
+        args.workers = 1
+        return args
+
+    def collect_hosts(self, agents):
+        '''Collect the hosts concurrently and yield (hostname, agent, sections, errors) as they are done'''
+        from concurrent.futures import as_completed, ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=self.args.workers, thread_name_prefix='agent_opnsense')
+        pager = None
+        if self.args.page_fanout > 1:
+            pager = ThreadPoolExecutor(max_workers=self.args.workers * self.args.page_fanout, thread_name_prefix='agent_opnsense_page')
+        try:
+            futures = {}
+            for hostname, agent in agents.items():
+                agent.pager = pager
+                agent.tracer = self.tracer
+                futures[executor.submit(agent.collect_all)] = hostname
+            for future in as_completed(futures):
+                hostname = futures[future]
+                try:
+                    sections, errors = future.result()
+                except Exception as exc:
+                    LOGGING.exception(f"Failed to collect {hostname}")
+                    sections, errors = [], {'agent': exc}
+                yield hostname, agents[hostname], sections, errors
+        finally:
+            executor.shutdown(cancel_futures=True)
+            if pager is not None:
+                pager.shutdown(cancel_futures=True)
+
+    def collect_all(self):
+        '''Fetch all enabled parts into memory and return the sections and errors'''
+        self.start_clock(time.thread_time)
+        sections, errors = [], {}
+        try:
+            for part in self.parts:
+                try:
+                    sections.extend(self.collect(part))
+                except CannotRecover as exc:
+                    errors[part] = exc
+        finally:
+            self.stop_clock()
+        return sections, errors
+
+    def start_clock(self, cpu_clock=time.process_time):
+        '''Start measuring the run
+
+        The CPU time of a single firewall is the process time, in collect
+        mode it is the time of the thread collecting it, without pages
+        fetched by the page fanout.
+        '''
+        self.started = time.monotonic()
+        self.cpu_clock = cpu_clock
+        self.cpu_started = cpu_clock()
+        self.section_times = {}
+
+    def stop_clock(self):
+        self.wall_time = time.monotonic() - self.started
+        self.cpu_time = self.cpu_clock() - self.cpu_started
+
+    def write_agent(self, errors):
+        with SectionWriter('opnsense_agent') as section:
+            section.append_json(dict(errors={part: str(exc) for part, exc in errors.items()}))
+        stats = dict(
+            wall_time=self.wall_time,
+            cpu_time=self.cpu_time,
+            sections=self.section_times,
+            endpoints=self.api.stats,
+        )
+        if self.api.adaptive is not None:
+            stats['concurrency'] = self.api.adaptive.summary()
+        with SectionWriter('opnsense_agent_stats') as section:
+            section.append_json(stats)
+
+    def remaining(self):
+        if self.args.deadline is None:
+            return None
+        return max(self.started + self.args.deadline - time.monotonic(), 0)
+
+    @contextmanager
+    def budget(self, part):
+        deadlines = []
+        if self.args.deadline is not None:
+            deadlines.append(self.started + self.args.deadline)
+        if part in dict(self.args.section_timeout):
+            deadlines.append(time.monotonic() + dict(self.args.section_timeout)[part])
+        token = DEADLINE.set(min(deadlines, default=None))
+        part_token = PART.set(part)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.section_times[part] = time.perf_counter() - started
+            if self.tracer is not None:
+                self.tracer.complete(f"section {part}", 'section', started, self.section_times[part], url=self.args.url)
+            PART.reset(part_token)
+            DEADLINE.reset(token)
+
+    def collect(self, part):
+        with self.budget(part):
+            return self.materialize(self.sections(part))
+
+    @staticmethod
+    def materialize(sections):
+        return [
+            (name, data if isinstance(data, dict) else list(data))
+            for name, data in sections
+        ]
+
+    def sections(self, part):
+        '''Return the sections of a part
+
+        Parts with a section interval are served from the section cache
+        until the interval has passed and are written with a cached
+        header, so Checkmk knows their age.
+        '''
+        interval = dict(self.args.section_interval).get(part)
+        if not interval:
+            return getattr(self, f"section_{part}")()
+
+        key = ('section', self.api.cache_owner, self.args.url, part)
+        entry = self.cache.load(*key, ttl=interval)
+        if entry is None:
+            entry = time.time(), self.materialize(getattr(self, f"section_{part}")())
+            self.cache.set(*key, data=entry[1], timestamp=entry[0])
+
+        timestamp, sections = entry
+        return [(f"{name}:cached({int(timestamp)},{int(interval)})", data) for name, data in sections]
+
+    def write_complete(self, sections):
+        '''Write the sections of a part once all of them are fetched
+
+        Rows are serialized as their pages arrive into a spool that moves
+        to a temporary file above SPOOL_SIZE, so the memory use follows
+        the page size. A part failing on a later page is dropped as a
+        whole like with concurrent workers.
+        '''
+        import shutil
+        import tempfile
+        with tempfile.SpooledTemporaryFile(max_size=self.SPOOL_SIZE, mode='w+', encoding='utf-8') as spool:
+            with redirect_stdout(spool):
+                self.write(sections)
+            spool.seek(0)
+            shutil.copyfileobj(spool, sys.stdout)
+
+    def write(self, sections):
+        for name, data in sections:
+            with SectionWriter(name) as section:
+                if isinstance(data, dict):
+                    section.append_json(data)
+                else:
+                    section.append_json(r for r in data)
+
+    def section_firewall(self):
+        yield 'opnsense_pf_states', self.api.get('diagnostics', 'firewall', 'pf_states')
+        yield 'opnsense_alias_table', self.api.get('firewall', 'alias', 'get_table_size')
+
+    def section_firmware(self):
+        yield 'opnsense_firmware', self.api.get('core', 'firmware', 'status')
+
+    def section_vip(self):
+        pages = self.api.paginate('diagnostics', 'interface', 'get_vip_status')
+        page = next(pages)
+        yield 'opnsense_carp', page['carp']
+        yield 'opnsense_vip', chain(page['rows'], (r for page in pages for r in page['rows']))
+
+    def section_gateway(self):
+        yield 'opnsense_gateway', self.api.get('routes', 'gateway', 'status')['items']
+
+    def section_ipsec(self):
+        connections = self.api.getIpsecConnections
+        yield 'opnsense_ipsec', connections
+
+        # Connections without an established phase1 have no phase2 to query
+        connected = set()
+        yield 'opnsense_ipsec_phase1', self._track_connected(self.api.search('ipsec', 'sessions', 'search_phase1'), connected)
+
+        if self.args.ipsec_phase2 == 'bulk':
+            yield 'opnsense_ipsec_phase2', self._phase2_by_connection(connections, connected)
+        else:
+            yield 'opnsense_ipsec_phase2', (
+                r
+                for conn in connections
+                if conn['uuid'] in connected
+                for r in self.api.getIpsecPhase2(conn['uuid'])
+            )
+
+    def _phase2_by_connection(self, connections, connected):
+        '''Group the SAs of the bulk search in connection order like the per connection searches'''
+        phase2s = {}
+        for r in self.api.search('ipsec', 'sessions', 'search_phase2'):
+            if r['state'] == 'INSTALLED' and r['ikeid'] in connected:
+                phase2s.setdefault(r['ikeid'], []).append(r)
+        for conn in connections:
+            yield from phase2s.get(conn['uuid'], [])
+
+    @staticmethod
+    def _track_connected(phase1s, connected):
+        for phase1 in phase1s:
+            if phase1['connected']:
+                connected.add(phase1['name'])
+            yield phase1
+
+    def section_unbound(self):
+        yield 'opnsense_unbound', self.api.get('unbound', 'diagnostics', 'stats')
+
+    def section_snapshot(self):
+        yield 'opnsense_snapshot', self.api.get('core', 'snapshots', 'search')['rows']
 
-        if self.args.firewall:
-            pass
-            with SectionWriter('opnsense_pf_states') as section:
-                section.append_json(self.api.get('diagnostics', 'firewall', 'pf_states'))
-            with SectionWriter('opnsense_alias_table') as section:
-                section.append_json(self.api.get('firewall', 'alias', 'get_table_size'))
-
-        if self.args.firmware:
-            with SectionWriter('opnsense_firmware') as section:
-                section.append_json(self.api.get('core', 'firmware', 'status'))
-
-        if self.args.vip:
-            with SectionWriter('opnsense_carp') as section:
-                section.append_json(self.api.getVipStatus['carp'])
-            with SectionWriter('opnsense_vip') as section:
-                section.append_json(r for r in self.api.getVipStatus['vips'])
-
-        if self.args.gateway:
-            with SectionWriter('opnsense_gateway') as section:
-                section.append_json(r for r in self.api.get('routes', 'gateway', 'status')['items'])
-
-        if self.args.ipsec:
-            with SectionWriter('opnsense_ipsec') as section:
-                section.append_json(r for r in self.api.getIpsecConnections)
-            with SectionWriter('opnsense_ipsec_phase1') as section:
-                section.append_json(r for r in self.api.getIpsecPhase1)
-            with SectionWriter('opnsense_ipsec_phase2') as section:
-                for conn in self.api.getIpsecConnections:
-                    section.append_json(r for r in self.api.getIpsecPhase2(conn['uuid']))
-
-        if self.args.unbound:
-            with SectionWriter('opnsense_unbound') as section:
-                section.append_json(self.api.get('unbound', 'diagnostics', 'stats'))
-
-        if self.args.snapshot:
-            with SectionWriter('opnsense_snapshot') as section:
-                section.append_json(r for r in self.api.get('core', 'snapshots', 'search')['rows'])
-
-        if self.args.ssl:
-            with SectionWriter('sslcertificates') as section:
-                for cert in self.api.get('trust', 'cert', 'search')['rows']:
-                    if cert['is_user'] == '1' or cert['in_use'] == '0':
-                        continue
-                    section.append_json(dict(
-                        file=cert['descr'],
-                        starts=int(cert['valid_from']),
-                        expires=int(cert['valid_to']),
-                        subj=cert['commonname'],
-                        issuer=cert['caref'],
-                    ))
+    def section_ssl(self):
+        yield 'sslcertificates', (
+            dict(
+                file=cert['descr'],
+                starts=int(cert['valid_from']),
+                expires=int(cert['valid_to']),
+                subj=cert['commonname'],
+                issuer=cert['caref'],
+            )
+            for cert in self.api.get('trust', 'cert', 'search')['rows']
+            if cert['is_user'] != '1' and cert['in_use'] != '0'
+        )
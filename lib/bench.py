@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk Extension for monitoring OpnSense.
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+'''Latency report of repeated agent runs for --bench
+
+The report is built from the section and request spans of the tracer,
+requests are attributed to the section by their part argument.
+'''
+
+import math
+
+
+def percentile(values, percent):
+    '''Nearest rank percentile of values'''
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * percent / 100) - 1, 0)]
+
+
+def failed_request(event):
+    status = event['args'].get('status')
+    return status is None or status >= 400
+
+
+def table(title, rows, runs):
+    '''Render rows of (name, durations in s, requests, bytes, failed) with counts per run'''
+    width = max([len(title), *(len(row[0]) for row in rows)])
+    lines = [f"{title:<{width}} {'req/run':>9} {'KiB/run':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'failed':>7}"]
+    for name, durations, requests, size, failed in rows:
+        if durations:
+            latency = f"{percentile(durations, 50) * 1000:>9.1f} {percentile(durations, 95) * 1000:>9.1f} {max(durations) * 1000:>9.1f}"
+        else:
+            latency = f"{'-':>9} {'-':>9} {'-':>9}"
+        lines.append(f"{name:<{width}} {requests / runs:>9.1f} {size / runs / 1024:>9.1f} {latency} {failed:>7}")
+    return '\n'.join(lines) + '\n'
+
+
+def report(url, runs, events):
+    '''Return the report of runs, a list of (wall time, errors by part), and the trace events of all runs'''
+    requests = [e for e in events if e['cat'] == 'request']
+    sections = {}
+    for event in events:
+        if event['cat'] == 'section':
+            sections.setdefault(event['name'].removeprefix('section '), []).append(event['dur'] / 1e6)
+    for _, errors in runs:
+        for part in errors:
+            sections.setdefault(part, [])
+    endpoints = {}
+    for event in requests:
+        endpoints.setdefault(event['name'], []).append(event)
+
+    count = len(runs)
+    return '\n'.join([
+        f"Benchmark of {url} with {count} runs\n",
+        table('run', [(
+            'agent',
+            [wall for wall, _ in runs],
+            len(requests),
+            sum(e['args']['bytes'] for e in requests),
+            sum(1 for _, errors in runs if errors),
+        )], count),
+        table('section', [(
+            part,
+            durations,
+            sum(1 for e in requests if e['args'].get('part') == part),
+            sum(e['args']['bytes'] for e in requests if e['args'].get('part') == part),
+            sum(1 for _, errors in runs if part in errors),
+        ) for part, durations in sorted(sections.items())], count),
+        table('endpoint', [(
+            name,
+            [e['dur'] / 1e6 for e in spans],
+            len(spans),
+            sum(e['args']['bytes'] for e in spans),
+            sum(1 for e in spans if failed_request(e)),
+        ) for name, spans in sorted(endpoints.items())], count),
+    ])
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk Extension for monitoring OpnSense.
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import suppress
+from pathlib import Path
+
+LOGGING = logging.getLogger('agent_opnsense')
+
+
+def default_cache_dir() -> Path:
+    if 'OMD_ROOT' in os.environ:
+        return Path(os.environ['OMD_ROOT']) / 'tmp' / 'check_mk' / 'agents' / 'agent_opnsense'
+    return Path(tempfile.gettempdir()) / 'agent_opnsense'
+
+
+def credentials_digest(key, secret) -> str:
+    '''Identify the owner of cache entries without keeping the credentials'''
+    return hashlib.sha256(f"{key}\0{secret}".encode()).hexdigest()
+
+
+class JSONCache:
+    '''Keeps JSON documents on disk for a limited time
+
+    Entries are written atomically. Missing, corrupt and expired entries
+    are all treated as a cache miss.
+    '''
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def path(self, *key) -> Path:
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        return self.directory / f"{digest}.json"
+
+    def load(self, *key, ttl):
+        '''Return the (timestamp, data) of an entry younger than ttl or None.'''
+        path = self.path(*key)
+        try:
+            with path.open() as fh:
+                entry = json.load(fh)
+            timestamp = float(entry['timestamp'])
+            data = entry['data']
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            LOGGING.debug(f"Ignoring corrupt cache entry {path}: {exc}")
+            return None
+        if not 0 <= time.time() - timestamp < ttl:
+            return None
+        return timestamp, data
+
+    def get(self, *key, ttl):
+        entry = self.load(*key, ttl=ttl)
+        return None if entry is None else entry[1]
+
+    def set(self, *key, data, timestamp=None):
+        path = self.path(*key)
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.', suffix='.tmp')
+        except OSError as exc:
+            LOGGING.debug(f"Could not write cache entry {path}: {exc}")
+            return
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(dict(timestamp=time.time() if timestamp is None else timestamp, data=data), fh)
+            os.replace(tmp, path)
+        except OSError as exc:
+            LOGGING.debug(f"Could not write cache entry {path}: {exc}")
+            with suppress(OSError):
+                os.unlink(tmp)
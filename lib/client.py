@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk Extension for monitoring OpnSense.
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# Thin client for the collector daemon of the OPNsense special agent.
+# It deliberately only uses the standard library to start up fast.
+
+import argparse
+import os
+import socket
+import sys
+import time
+from typing import Optional, Sequence
+
+
+def socket_path(path: str) -> str:
+    '''Resolve a relative path against the site like the datasource rule does'''
+    if not os.path.isabs(path) and 'OMD_ROOT' in os.environ:
+        return os.path.join(os.environ['OMD_ROOT'], path)
+    return path
+
+
+def read_output(path: str, hostname: str, timeout: float) -> bytes:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(f"{hostname}\n".encode())
+        chunks = []
+        while chunk := sock.recv(65536):
+            chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Read the OPNsense agent output of a host from the collector daemon.')
+    parser.add_argument('--socket',
+                        dest='socket',
+                        required=True,
+                        help='Unix socket of the collector daemon, relative paths are relative to $OMD_ROOT.')
+    parser.add_argument('--hostname',
+                        dest='hostname',
+                        required=True,
+                        help='Host to read the output for.')
+    parser.add_argument('--max-age',
+                        dest='max_age',
+                        type=float,
+                        default=180,
+                        help='Maximum age of the output in seconds. (Default: 180)')
+    parser.add_argument('-t', '--timeout',
+                        dest='timeout',
+                        type=float,
+                        default=10,
+                        help='Socket timeout. (Default: 10)')
+    args = parser.parse_args(argv)
+
+    path = socket_path(args.socket)
+    try:
+        data = read_output(path, args.hostname, args.timeout)
+    except OSError as exc:
+        sys.stderr.write(f"Could not read from collector daemon at {path}: {exc}\n")
+        return 1
+
+    timestamp, _, output = data.partition(b'\n')
+    if not timestamp:
+        sys.stderr.write(f"Collector daemon has no data for {args.hostname}\n")
+        return 1
+
+    try:
+        age = time.time() - float(timestamp)
+    except ValueError:
+        sys.stderr.write(f"Collector daemon sent invalid data for {args.hostname}\n")
+        return 1
+    if age > args.max_age:
+        sys.stderr.write(f"Data of collector daemon for {args.hostname} is {age:.0f}s old\n")
+        return 1
+
+    sys.stdout.write(output.decode())
+    return 0
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk Extension for monitoring OpnSense.
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+'''JSON decoding for the agent and the check plugins
+
+get_loads() returns the fastest of the DECODERS that can be imported and
+falls back to the json module of the standard library. The decoder is
+selected and imported on first use, not when the module is loaded. Decoders take str or
+bytes and raise a subclass of json.JSONDecodeError on invalid input.
+'''
+
+import json
+from functools import lru_cache
+from importlib import import_module
+from json import JSONDecodeError  # noqa: F401
+
+
+def _orjson():
+    return import_module('orjson').loads
+
+
+def _stdlib():
+    return json.loads
+
+
+# Ordered by preference
+DECODERS = {
+    'orjson': _orjson,
+    'json': _stdlib,
+}
+
+
+def available_decoders():
+    '''Return the loads function of every decoder that can be imported by name'''
+    decoders = {}
+    for name, factory in DECODERS.items():
+        try:
+            decoders[name] = factory()
+        except ImportError:
+            continue
+    return decoders
+
+
+def select_decoder():
+    for factory in DECODERS.values():
+        try:
+            return factory()
+        except ImportError:
+            continue
+
+
+@lru_cache(maxsize=None)
+def get_loads():
+    '''Return the loads function of the selected decoder, imported on first use'''
+    return select_decoder()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk Extension for monitoring OpnSense.
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+'''Profiling of single agent runs
+
+pstats files contain a cProfile of the thread calling the profiled
+function. Collapsed stacks are sampled from all threads, including the
+section workers and page fetchers, and count waiting on the firewall as
+well as CPU time. They can be rendered with flamegraph.pl or speedscope.
+'''
+
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+LOGGING = logging.getLogger('agent_opnsense')
+
+FORMATS = ['pstats', 'collapsed']
+
+
+def default_profile_dir() -> Path:
+    if 'OMD_ROOT' in os.environ:
+        return Path(os.environ['OMD_ROOT']) / 'var' / 'check_mk' / 'agent_opnsense' / 'profiles'
+    return Path(tempfile.gettempdir()) / 'agent_opnsense' / 'profiles'
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{Path(code.co_filename).stem}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class StackSampler:
+    '''Counts the stacks of all other threads every interval seconds'''
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='agent_opnsense_sampler', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_name(frame))
+                    frame = frame.f_back
+                self.stacks[';'.join([names.get(ident, str(ident)), *reversed(stack)])] += 1
+
+    def write(self, fh):
+        for stack, count in sorted(self.stacks.items()):
+            fh.write(f"{stack} {count}\n")
+
+
+def write_profile(path, write):
+    '''Call write with path, a profile that can not be written must not fail the run'''
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write(path)
+    except OSError as exc:
+        LOGGING.error(f"Could not write profile to {path}: {exc}")
+    else:
+        LOGGING.info(f"Wrote profile to {path}")
+
+
+def write_stacks(sampler):
+    def write(path):
+        with path.open('w') as fh:
+            sampler.write(fh)
+    return write
+
+
+def profile_call(func, directory, name, fmt='pstats'):
+    '''Call func and write its profile to directory/<name>-<time>-<pid>.<fmt>'''
+    path = Path(directory) / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.{fmt}"
+    if fmt == 'pstats':
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func)
+        finally:
+            write_profile(path, profiler.dump_stats)
+
+    sampler = StackSampler()
+    try:
+        with sampler:
+            return func()
+    finally:
+        write_profile(path, write_stacks(sampler))
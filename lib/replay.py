@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk Extension for monitoring OpnSense.
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+'''Record API responses and serve them back without a firewall
+
+Both are transport adapters of requests, so status handling, timeouts,
+statistics and traces of OSAPI behave the same on replay. Recordings
+are keyed by method, path, query and body of the request, not by the
+host, so they can be replayed with any URL. They contain the API
+responses in clear text but no credentials.
+'''
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import requests
+from requests.adapters import BaseAdapter, DEFAULT_POOLSIZE, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+LOGGING = logging.getLogger('agent_opnsense')
+
+
+def request_key(request) -> str:
+    body = request.body or b''
+    if isinstance(body, str):
+        body = body.encode()
+    digest = hashlib.sha256()
+    digest.update(f"{request.method} {request.path_url}\n".encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class RecordingAdapter(HTTPAdapter):
+    def __init__(self, directory, pool_maxsize=DEFAULT_POOLSIZE):
+        super().__init__(pool_maxsize=max(pool_maxsize, DEFAULT_POOLSIZE))
+        self.directory = Path(directory)
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        body = request.body or b''
+        record = dict(
+            method=request.method,
+            path=request.path_url,
+            body=body.decode() if isinstance(body, bytes) else body,
+            status=response.status_code,
+            reason=response.reason,
+            headers={'Content-Type': response.headers.get('Content-Type', 'application/json')},
+            content=response.content.decode('utf-8', errors='replace'),
+            elapsed=response.elapsed.total_seconds(),
+        )
+        path = self.directory / f"{request_key(request)}.json"
+        tmp = path.with_name(f".{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with tmp.open('w') as fh:
+            json.dump(record, fh)
+        os.replace(tmp, path)
+        LOGGING.debug(f"Recorded {request.method} {request.path_url} to {path}")
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    '''Answer requests from the recordings in directory
+
+    The recorded response time multiplied by latency is waited before
+    answering, a read timeout shorter than that raises a ReadTimeout.
+    '''
+
+    def __init__(self, directory, latency=0.0):
+        super().__init__()
+        self.directory = Path(directory)
+        self.latency = latency
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        path = self.directory / f"{request_key(request)}.json"
+        try:
+            with path.open() as fh:
+                record = json.load(fh)
+        except FileNotFoundError:
+            raise requests.exceptions.ConnectionError(f"No recorded response for {request.method} {request.path_url}", request=request)
+
+        delay = record['elapsed'] * self.latency
+        read_timeout = timeout[1] if isinstance(timeout, tuple) else timeout
+        if read_timeout is not None and delay > read_timeout:
+            time.sleep(read_timeout)
+            raise requests.exceptions.ReadTimeout(f"Replayed response takes {delay:g}s", request=request)
+        if delay > 0:
+            time.sleep(delay)
+
+        response = requests.Response()
+        response.status_code = record['status']
+        response.reason = record.get('reason')
+        response.headers = CaseInsensitiveDict(record.get('headers', {}))
+        response._content = record['content'].encode()
+        response._content_consumed = True
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
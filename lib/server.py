@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk Extension for monitoring OpnSense.
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os
+import socketserver
+from contextlib import suppress
+
+
+class CollectorRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        hostname = self.rfile.readline().decode().strip()
+        entry = self.server.outputs.get(hostname)
+        if entry is not None:
+            timestamp, output = entry
+            self.wfile.write(f"{timestamp}\n{output}".encode())
+
+
+class CollectorServer(socketserver.ThreadingUnixStreamServer):
+    '''Serves the latest output of a host on a Unix socket
+
+    Clients send the hostname terminated by a newline and get the time of
+    the collection and the agent output back. Unknown hosts get an empty
+    answer.
+    '''
+    daemon_threads = True
+
+    def __init__(self, path):
+        with suppress(FileNotFoundError):
+            os.unlink(path)
+        umask = os.umask(0o077)
+        try:
+            super().__init__(path, CollectorRequestHandler)
+        finally:
+            os.umask(umask)
+        self.outputs = {}
+
+    def server_close(self):
+        super().server_close()
+        with suppress(FileNotFoundError):
+            os.unlink(self.server_address)
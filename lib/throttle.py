@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk Extension for monitoring OpnSense.
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+'''Rate, concurrency and adaptive limits of the requests sent to a firewall'''
+
+import threading
+import time
+
+
+class TokenBucket:
+    '''Allow rate requests per second with bursts of up to burst requests
+
+    Callers reserve a token and wait until it is due instead of polling
+    for it, so concurrent callers are served in the order they asked.
+    '''
+
+    def __init__(self, rate, burst=1, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        '''Take a token and return the seconds until it may be used'''
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(-self.tokens / self.rate, 0.0)
+
+    def refund(self):
+        '''Return a reserved token that was not used'''
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+
+class AdaptiveLimit:
+    '''Limit of concurrent requests adapted to the responses of the firewall
+
+    Works like the congestion window of TCP (AIMD). The limit starts at
+    one request and grows by one with every good response until the
+    first sign of overload, then by one per limit good responses. A
+    failed request or a response slower than tolerance times the fastest
+    successful one from the same endpoint halves the limit. The fastest
+    response decays by the factor decay per response within tolerance,
+    so the limit follows a firewall whose latency drifts, while a steady
+    overload keeps decreasing it instead of becoming the baseline. Only
+    requests started after the last decrease can decrease it again, so a
+    single overload is not counted once per request in flight.
+    '''
+
+    def __init__(self, maximum, tolerance=2.0, jitter=0.01, decay=1.01, clock=time.perf_counter):
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.jitter = jitter
+        self.decay = decay
+        self.clock = clock
+        self.limit = 1.0
+        self.peak = 1
+        self.decreases = 0
+        self.in_flight = 0
+        self.slow_start = True
+        self.baseline = {}
+        self.decreased = float('-inf')
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout=None) -> bool:
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.in_flight < int(self.limit), timeout):
+                return False
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            return True
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def observe(self, endpoint, started, seconds, status):
+        '''Adapt the limit to a request started at clock() time started, status is None without a response'''
+        with self._cond:
+            # Errors are often fast and must not set the pace of good responses
+            failed = status is None or status == 429 or status >= 500
+            baseline = self.baseline.get(endpoint, seconds)
+            slow = seconds > self.tolerance * baseline + self.jitter
+            if not failed and not slow:
+                self.baseline[endpoint] = min(baseline * self.decay, seconds)
+            if failed or slow:
+                if started > self.decreased:
+                    self.limit = max(self.limit / 2, 1.0)
+                    self.decreased = self.clock()
+                    self.decreases += 1
+                    self.slow_start = False
+            elif self.slow_start:
+                self.limit = min(self.limit + 1, self.maximum)
+            else:
+                self.limit = min(self.limit + 1 / self.limit, self.maximum)
+            self._cond.notify_all()
+
+    def summary(self):
+        return dict(limit=int(self.limit), maximum=self.maximum, peak=self.peak, decreases=self.decreases)
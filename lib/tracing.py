@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk Extension for monitoring OpnSense.
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+'''Waterfall traces of agent runs in the Chrome trace event format
+
+The written files can be opened in chrome://tracing, Perfetto or
+speedscope. Every span is a complete event ("ph": "X") on the thread
+it ran in, timestamps are microseconds since the tracer was created.
+'''
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Tracer:
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.events = []
+        self.threads = {}
+        self._lock = threading.Lock()
+
+    def complete(self, name, category, started, duration, **args):
+        '''Add a span started at perf_counter() time started lasting duration seconds'''
+        thread = threading.current_thread()
+        event = dict(
+            name=name,
+            cat=category,
+            ph='X',
+            ts=round((started - self.origin) * 1e6, 1),
+            dur=round(duration * 1e6, 1),
+            pid=os.getpid(),
+            tid=thread.ident,
+            args=args,
+        )
+        with self._lock:
+            self.events.append(event)
+            self.threads[thread.ident] = thread.name
+
+    @contextmanager
+    def span(self, name, category, **args):
+        '''Trace the block, args added to the yielded dict end up in the span'''
+        started = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.complete(name, category, started, time.perf_counter() - started, **args)
+
+    def trace(self):
+        pid = os.getpid()
+        metadata = [
+            dict(name='process_name', ph='M', pid=pid, tid=0, args=dict(name='agent_opnsense')),
+            *(
+                dict(name='thread_name', ph='M', pid=pid, tid=tid, args=dict(name=name))
+                for tid, name in self.threads.items()
+            ),
+        ]
+        return dict(traceEvents=metadata + sorted(self.events, key=lambda e: e['ts']), displayTimeUnit='ms')
+
+    def write(self, path):
+        with open(path, 'w') as fh:
+            json.dump(self.trace(), fh)
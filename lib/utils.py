@@ -18,10 +18,10 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
-import json
 from typing import Any
 
 from cmk.agent_based.v2 import StringTable
+from cmk_addons.plugins.opnsense.lib.decoder import get_loads
 
 JSONSection = dict[str, Any] | None
 JSONLSection = list[dict[str, Any]] | None
@@ -29,14 +29,15 @@ JSONLSection = list[dict[str, Any]] | None
 
 def parse_json(string_table: StringTable) -> JSONSection:
     if string_table:
-        return json.loads(string_table[0][0])
+        return get_loads()(string_table[0][0])
     return None
 
 
 def parse_jsonl(string_table: StringTable) -> JSONLSection:
     if string_table:
+        loads = get_loads()
         return [
-            json.loads(line[0])
+            loads(line[0])
             for line in string_table
         ]
     return None
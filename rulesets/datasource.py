@@ -19,17 +19,21 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
-from cmk.rulesets.v1 import Title, Help, Label
+from cmk.rulesets.v1 import Title, Help, Label, Message
 from cmk.rulesets.v1.form_specs import (
     BooleanChoice,
     DefaultValue,
     DictElement,
     Dictionary,
+    Float,
+    Integer,
     migrate_to_password,
     Password,
     SingleChoice,
     SingleChoiceElement,
     String,
+    TimeMagnitude,
+    TimeSpan,
     validators,
 )
 from cmk.rulesets.v1.rule_specs import SpecialAgent, Topic
@@ -59,6 +63,23 @@ def migrate_special_agents_opnsense(model: dict) -> dict:
     return model
 
 
+PART_TITLES = [
+    ('firewall', Title('Firewall')),
+    ('firmware', Title('Firmware')),
+    ('vip', Title('VIP')),
+    ('gateway', Title('Gateway')),
+    ('ipsec', Title('IPSec')),
+    ('unbound', Title('Unbound')),
+    ('snapshot', Title('Snapshot')),
+    ('ssl', Title('SSL Cert')),
+]
+
+
+def validate_page_size(value: int) -> None:
+    if value == 0 or value < -1:
+        raise validators.ValidationError(Message('The page size must be -1 or at least 1.'))
+
+
 def _form_special_agents_opnsense() -> Dictionary:
     return Dictionary(
         title=Title('Dell Storage via Dell Storage API'),
@@ -156,6 +177,276 @@ def _form_special_agents_opnsense() -> Dictionary:
                 ),
                 required=True,
             ),
+            'ipsec_child': DictElement(
+                parameter_form=SingleChoice(
+                    title=Title('IPSec child definitions'),
+                    help_text=Help(
+                        'How to fetch the child definitions of IPSec connections. '
+                        'Fetching them per connection costs one request per connection. '
+                        'No check uses them at the moment, so they can also be skipped.'
+                    ),
+                    elements=[
+                        SingleChoiceElement(name='connection', title=Title('Fetch per connection')),
+                        SingleChoiceElement(name='bulk', title=Title('Fetch in one search')),
+                        SingleChoiceElement(name='skip', title=Title('Do not fetch')),
+                    ],
+                    prefill=DefaultValue('connection'),
+                ),
+                required=False,
+            ),
+            'ipsec_phase2': DictElement(
+                parameter_form=SingleChoice(
+                    title=Title('IPSec phase2 sessions'),
+                    help_text=Help(
+                        'How to fetch the phase2 sessions of IPSec connections. '
+                        'Fetching them per connection costs one request per connection.'
+                    ),
+                    elements=[
+                        SingleChoiceElement(name='connection', title=Title('Fetch per connection')),
+                        SingleChoiceElement(name='bulk', title=Title('Fetch in one search')),
+                    ],
+                    prefill=DefaultValue('connection'),
+                ),
+                required=False,
+            ),
+            'timeout': DictElement(
+                parameter_form=TimeSpan(
+                    title=Title('Read timeout'),
+                    help_text=Help('Time to wait for the answer of a single API request.'),
+                    displayed_magnitudes=[TimeMagnitude.SECOND],
+                    prefill=DefaultValue(10.0),
+                ),
+                required=False,
+            ),
+            'connect_timeout': DictElement(
+                parameter_form=TimeSpan(
+                    title=Title('Connect timeout'),
+                    help_text=Help('Time to wait for the connection to the API. Defaults to the read timeout.'),
+                    displayed_magnitudes=[TimeMagnitude.SECOND],
+                    prefill=DefaultValue(5.0),
+                ),
+                required=False,
+            ),
+            'deadline': DictElement(
+                parameter_form=TimeSpan(
+                    title=Title('Total time budget'),
+                    help_text=Help(
+                        'Maximum run time of the agent. Sections not fetched in time are '
+                        'reported by the OPNsense Agent service, all other sections are still shown.'
+                    ),
+                    displayed_magnitudes=[TimeMagnitude.SECOND],
+                    prefill=DefaultValue(50.0),
+                ),
+                required=False,
+            ),
+            'section_timeout': DictElement(
+                parameter_form=Dictionary(
+                    title=Title('Section time budgets'),
+                    help_text=Help('Maximum time spent on fetching a single section.'),
+                    elements={
+                        part: DictElement(
+                            parameter_form=TimeSpan(
+                                title=title,
+                                displayed_magnitudes=[TimeMagnitude.SECOND],
+                                prefill=DefaultValue(10.0),
+                            ),
+                            required=False,
+                        )
+                        for part, title in PART_TITLES
+                    },
+                ),
+                required=False,
+            ),
+            'cache_ttl': DictElement(
+                parameter_form=Dictionary(
+                    title=Title('Cache API responses'),
+                    help_text=Help(
+                        'Reuse the API responses of rarely changing data for the given time '
+                        'instead of fetching them on every run. For IPSec only the connection '
+                        'definitions are cached, not the session status.'
+                    ),
+                    elements={
+                        part: DictElement(
+                            parameter_form=TimeSpan(
+                                title=title,
+                                displayed_magnitudes=[TimeMagnitude.HOUR, TimeMagnitude.MINUTE],
+                                prefill=DefaultValue(3600.0),
+                            ),
+                            required=False,
+                        )
+                        for part, title in PART_TITLES
+                        if part in ['firmware', 'ipsec', 'snapshot', 'ssl']
+                    },
+                ),
+                required=False,
+            ),
+            'section_interval': DictElement(
+                parameter_form=Dictionary(
+                    title=Title('Section check intervals'),
+                    help_text=Help(
+                        'Fetch a section only once per interval. In between the last result is '
+                        'reused and handed to Checkmk as cached section with its age.'
+                    ),
+                    elements={
+                        part: DictElement(
+                            parameter_form=TimeSpan(
+                                title=title,
+                                displayed_magnitudes=[TimeMagnitude.HOUR, TimeMagnitude.MINUTE],
+                                prefill=DefaultValue(3600.0),
+                            ),
+                            required=False,
+                        )
+                        for part, title in PART_TITLES
+                    },
+                ),
+                required=False,
+            ),
+            'daemon_socket': DictElement(
+                parameter_form=String(
+                    title=Title('Read from collector daemon'),
+                    help_text=Help(
+                        'Read the output of this host from the Unix socket of an agent started with '
+                        '--collect and --daemon instead of querying the API. The daemon needs '
+                        'the host in its list of firewalls. Relative paths are relative to the site directory.'
+                    ),
+                    prefill=DefaultValue('tmp/run/agent_opnsense.sock'),
+                    macro_support=True,
+                ),
+                required=False,
+            ),
+            'workers': DictElement(
+                parameter_form=Integer(
+                    title=Title('Concurrent sections'),
+                    help_text=Help('Number of sections fetched from the API at the same time.'),
+                    prefill=DefaultValue(1),
+                    custom_validate=(validators.NumberInRange(min_value=1, max_value=16),),
+                ),
+                required=False,
+            ),
+            'page_fanout': DictElement(
+                parameter_form=Integer(
+                    title=Title('Concurrent pages'),
+                    help_text=Help('Number of pages of a large search fetched from the API at the same time.'),
+                    prefill=DefaultValue(1),
+                    custom_validate=(validators.NumberInRange(min_value=1, max_value=16),),
+                ),
+                required=False,
+            ),
+            'rate_limit': DictElement(
+                parameter_form=Dictionary(
+                    title=Title('Limit API request rate'),
+                    help_text=Help(
+                        'Limit the API requests per second sent to the firewall, over all concurrent '
+                        'sections and pages. Waiting for the limit counts against the deadline.'
+                    ),
+                    elements={
+                        'rate': DictElement(
+                            parameter_form=Float(
+                                title=Title('Requests per second'),
+                                prefill=DefaultValue(10.0),
+                                custom_validate=(validators.NumberInRange(min_value=0.1),),
+                            ),
+                            required=True,
+                        ),
+                        'burst': DictElement(
+                            parameter_form=Integer(
+                                title=Title('Burst'),
+                                help_text=Help('Number of requests sent at once after a pause.'),
+                                prefill=DefaultValue(1),
+                                custom_validate=(validators.NumberInRange(min_value=1),),
+                            ),
+                            required=False,
+                        ),
+                    },
+                ),
+                required=False,
+            ),
+            'max_in_flight': DictElement(
+                parameter_form=Integer(
+                    title=Title('Concurrent API requests'),
+                    help_text=Help(
+                        'Maximum number of API requests to the firewall at the same time, '
+                        'over all concurrent sections and pages.'
+                    ),
+                    prefill=DefaultValue(2),
+                    custom_validate=(validators.NumberInRange(min_value=1, max_value=64),),
+                ),
+                required=False,
+            ),
+            'adaptive_concurrency': DictElement(
+                parameter_form=BooleanChoice(
+                    title=Title('Adaptive concurrency'),
+                    label=Label('Adapt the concurrent API requests to the firewall'),
+                    help_text=Help(
+                        'Start with a single API request at a time and send more while the firewall answers '
+                        'quickly. Slow responses and server errors halve the number of concurrent requests. '
+                        'The upper bound is the number of concurrent API requests or otherwise concurrent '
+                        'sections times concurrent pages.'
+                    ),
+                    prefill=DefaultValue(False),
+                ),
+                required=False,
+            ),
+            'page_size': DictElement(
+                parameter_form=Dictionary(
+                    title=Title('Search page size'),
+                    help_text=Help(
+                        'Number of rows requested per page from the search endpoints. '
+                        'Use -1 to fetch all rows in a single request. '
+                        'Without a setting the default page size of the API is used.'
+                    ),
+                    elements={
+                        name: DictElement(
+                            parameter_form=Integer(
+                                title=title,
+                                prefill=DefaultValue(-1),
+                                custom_validate=(validate_page_size,),
+                            ),
+                            required=False,
+                        )
+                        for name, title in [
+                            ('all', Title('All searches')),
+                            ('get_vip_status', Title('VIP status')),
+                            ('search_connection', Title('IPSec connections')),
+                            ('search_child', Title('IPSec childs')),
+                            ('search_phase1', Title('IPSec phase1 sessions')),
+                            ('search_phase2', Title('IPSec phase2 sessions')),
+                        ]
+                    },
+                ),
+                required=False,
+            ),
+            'profile': DictElement(
+                parameter_form=Dictionary(
+                    title=Title('Profile agent runs'),
+                    help_text=Help(
+                        'Write a profile of the agent run to var/check_mk/agent_opnsense/profiles '
+                        'in the site. Only enable this for a limited time.'
+                    ),
+                    elements={
+                        'format': DictElement(
+                            parameter_form=SingleChoice(
+                                title=Title('Format'),
+                                elements=[
+                                    SingleChoiceElement(name='pstats', title=Title('cProfile pstats of the main thread')),
+                                    SingleChoiceElement(name='collapsed', title=Title('Sampled collapsed stacks of all threads')),
+                                ],
+                                prefill=DefaultValue('pstats'),
+                            ),
+                            required=True,
+                        ),
+                        'every': DictElement(
+                            parameter_form=Integer(
+                                title=Title('Profile one in N runs'),
+                                prefill=DefaultValue(10),
+                                custom_validate=(validators.NumberInRange(min_value=1),),
+                            ),
+                            required=True,
+                        ),
+                    },
+                ),
+                required=False,
+            ),
         },
         migrate=migrate_special_agents_opnsense,
     )
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2024  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from cmk.rulesets.v1 import Help, Title
+from cmk.rulesets.v1.form_specs import (
+    DefaultValue,
+    DictElement,
+    Dictionary,
+    InputHint,
+    LevelDirection,
+    LevelsType,
+    SimpleLevels,
+    TimeMagnitude,
+    TimeSpan,
+)
+from cmk.rulesets.v1.rule_specs import CheckParameters, Topic, HostCondition
+
+
+def _parameter_form_opnsense_agent_stats():
+    return Dictionary(
+        elements={
+            'runtime': DictElement(
+                parameter_form=SimpleLevels(
+                    title=Title('Agent runtime'),
+                    help_text=Help('Wall time of the special agent for all sections of the firewall.'),
+                    level_direction=LevelDirection.UPPER,
+                    form_spec_template=TimeSpan(displayed_magnitudes=[TimeMagnitude.SECOND, TimeMagnitude.MILLISECOND]),
+                    prefill_levels_type=DefaultValue(LevelsType.FIXED),
+                    prefill_fixed_levels=InputHint(value=(30.0, 50.0)),
+                ),
+                required=False,
+            ),
+            'section_time': DictElement(
+                parameter_form=SimpleLevels(
+                    title=Title('Section time'),
+                    help_text=Help('Time spent fetching each section.'),
+                    level_direction=LevelDirection.UPPER,
+                    form_spec_template=TimeSpan(displayed_magnitudes=[TimeMagnitude.SECOND, TimeMagnitude.MILLISECOND]),
+                    prefill_levels_type=DefaultValue(LevelsType.FIXED),
+                    prefill_fixed_levels=InputHint(value=(10.0, 20.0)),
+                ),
+                required=False,
+            ),
+        }
+    )
+
+
+rule_spec_opnsense_agent_stats = CheckParameters(
+    name='opnsense_agent_stats',
+    topic=Topic.NETWORKING,
+    parameter_form=_parameter_form_opnsense_agent_stats,
+    title=Title('OPNsense Agent Performance'),
+    help_text=Help('This rule configures thresholds for the runtime of the OPNsense special agent.'),
+    condition=HostCondition(),
+)
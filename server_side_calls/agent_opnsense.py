@@ -40,12 +40,35 @@ class Params(BaseModel):
     unbound: bool = False
     snapshot: bool = False
     ssl: bool = False
+    timeout: float | None = None
+    connect_timeout: float | None = None
+    deadline: float | None = None
+    section_timeout: dict[str, float] = {}
+    cache_ttl: dict[str, float] = {}
+    section_interval: dict[str, float] = {}
+    ipsec_child: str = 'connection'
+    ipsec_phase2: str = 'connection'
+    daemon_socket: str | None = None
+    workers: int = 1
+    page_fanout: int = 1
+    page_size: dict[str, int] = {}
+    rate_limit: dict[str, float] | None = None
+    max_in_flight: int | None = None
+    adaptive_concurrency: bool = False
+    profile: dict[str, str | int] | None = None
 
 
 def commands_function(
     params: Params,
     host_config: HostConfig,
 ) -> Iterator[SpecialAgentCommand]:
+    if params.daemon_socket:
+        yield SpecialAgentCommand(command_arguments=[
+            '--socket', replace_macros(params.daemon_socket, host_config.macros),
+            '--hostname', host_config.name,
+        ])
+        return
+
     command_arguments: list[str | Secret] = [
         '-U', replace_macros(params.url, host_config.macros),
         '-k', params.key,
@@ -58,6 +81,53 @@ def commands_function(
         if getattr(params, part, False):
             command_arguments += [f"--{part}"]
 
+    if params.timeout is not None:
+        command_arguments += ['--timeout', f"{params.timeout:g}"]
+    if params.connect_timeout is not None:
+        command_arguments += ['--connect-timeout', f"{params.connect_timeout:g}"]
+    if params.deadline is not None:
+        command_arguments += ['--deadline', f"{params.deadline:g}"]
+    for part, seconds in params.section_timeout.items():
+        command_arguments += ['--section-timeout', f"{part}={seconds:g}"]
+
+    for part, seconds in params.cache_ttl.items():
+        command_arguments += ['--cache-ttl', f"{part}={seconds:g}"]
+    for part, seconds in params.section_interval.items():
+        command_arguments += ['--section-interval', f"{part}={seconds:g}"]
+
+    if params.ipsec_child != 'connection':
+        command_arguments += ['--ipsec-child', params.ipsec_child]
+
+    if params.ipsec_phase2 != 'connection':
+        command_arguments += ['--ipsec-phase2', params.ipsec_phase2]
+
+    if params.workers > 1:
+        command_arguments += ['--workers', str(params.workers)]
+
+    if params.page_fanout > 1:
+        command_arguments += ['--page-fanout', str(params.page_fanout)]
+
+    for command, rows in params.page_size.items():
+        command_arguments += ['--page-size', str(rows) if command == 'all' else f"{command}={rows}"]
+
+    if params.rate_limit is not None:
+        command_arguments += ['--rate-limit', f"{params.rate_limit['rate']:g}"]
+        if 'burst' in params.rate_limit:
+            command_arguments += ['--rate-burst', str(int(params.rate_limit['burst']))]
+
+    if params.max_in_flight is not None:
+        command_arguments += ['--max-in-flight', str(params.max_in_flight)]
+
+    if params.adaptive_concurrency:
+        command_arguments += ['--adaptive-concurrency']
+
+    if params.profile is not None:
+        command_arguments += [
+            '--profile',
+            '--profile-format', str(params.profile['format']),
+            '--profile-every', str(params.profile['every']),
+        ]
+
     yield SpecialAgentCommand(command_arguments=command_arguments)
 
 
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+'''Run the agent end to end against a synthetic firewall.
+
+The stub runs in its own process so it does not compete with the agent
+for the GIL. Reports the median wall time, the API requests, the size
+of the agent output and the peak of the Python heap (tracemalloc, in a
+separate run) per scale. Arguments after -- are passed to the agent.
+
+    python3 tests/benchmark/bench_agent.py --scale large --latency 0.01 -- --workers 4 --ipsec-phase2 bulk
+'''
+
+import argparse
+import statistics
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+import synthetic
+from cmk_addons.plugins.opnsense.lib.agent import AgentOpnSense
+from opnsense_stub import stub_process
+
+ALL_PARTS = ['--firewall', '--firmware', '--vip', '--gateway', '--ipsec', '--unbound', '--snapshot', '--ssl']
+
+
+class CountingSink:
+    '''Discards the agent output and counts its size'''
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+
+def run_agent(argv):
+    agent = AgentOpnSense()
+    args = agent.parse_arguments(argv)
+    sink = CountingSink()
+    start = time.perf_counter()
+    with redirect_stdout(sink):
+        agent.main(args)
+    duration = time.perf_counter() - start
+    return duration, sum(e['requests'] for e in agent.api.stats.values()), sink.size
+
+
+def peak_memory(argv):
+    tracemalloc.start()
+    try:
+        run_agent(argv)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=list(synthetic.SCALES), action='append', help='Firewall sizes to run. (Default: all)')
+    parser.add_argument('--runs', type=int, default=3, help='Runs per scale, the median is reported. (Default: 3)')
+    parser.add_argument('--latency', type=float, default=0.005, help='Latency per request in seconds. (Default: 0.005)')
+    parser.add_argument('--server-page-size', type=int, default=25, help='Default page size of the stub. (Default: 25)')
+    parser.add_argument('--server-workers', type=int, help='Requests the stub serves at the same time, the others queue. (Default: unlimited)')
+    parser.add_argument('agent_args', nargs=argparse.REMAINDER, help='Arguments for the agent after --.')
+    args = parser.parse_args()
+    agent_args = [a for a in args.agent_args if a != '--']
+
+    print(f"agent arguments: {' '.join(agent_args) or '-'}")
+    print(f"{'scale':>8} {'wall s':>8} {'requests':>9} {'output KiB':>11} {'peak MiB':>9}")
+    for scale in args.scale or list(synthetic.SCALES):
+        with stub_process(synthetic.firewall(**synthetic.SCALES[scale]), args.latency, args.server_page_size, args.server_workers) as url:
+            argv = ['-U', url, '-k', 'key', '-s', 'secret', *ALL_PARTS, *agent_args]
+            runs = [run_agent(argv) for _ in range(args.runs)]
+            peak = peak_memory(argv)
+        wall = statistics.median(r[0] for r in runs)
+        print(f"{scale:>8} {wall:>8.3f} {runs[0][1]:>9} {runs[0][2] / 1024:>11.0f} {peak / 2**20:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+'''Time the discovery and check functions on sections of growing size.
+
+For every size the sections are generated with synthetic.py, parsed
+from their string tables and discovered. The check function is run for
+up to --sample services spread over all discovered items, or as many
+as fit into --budget seconds. Reported are the discovery time, the mean
+time per service and the time of a whole check cycle of the host
+(extrapolated from the sample, marked with ~).
+The exponent is the growth of the time per service against the size of
+the previous row: about 0 means a cycle scales linearly, about 1 means
+every service scans the whole section and the cycle is quadratic.
+
+    python3 tests/benchmark/bench_checks.py --size 10 --size 1000 --size 10000
+'''
+
+import argparse
+import json
+import math
+import random
+import time
+
+import synthetic
+from cmk_addons.plugins.opnsense.agent_based import (
+    opnsense_gateway,
+    opnsense_ipsec,
+    opnsense_unbound,
+    opnsense_vip,
+)
+from cmk_addons.plugins.opnsense.lib.utils import parse_json, parse_jsonl
+
+
+def string_table(rows):
+    if isinstance(rows, dict):
+        return [[json.dumps(rows)]]
+    return [[json.dumps(row)] for row in rows]
+
+
+def ipsec_sections(size, rng):
+    connections, _, phase1, phase2 = synthetic.ipsec(size, 1, 0.0, rng)
+    return dict(
+        section_opnsense_ipsec=parse_jsonl(string_table(connections)),
+        section_opnsense_ipsec_phase1=parse_jsonl(string_table(phase1)),
+        section_opnsense_ipsec_phase2=opnsense_ipsec.parse_opnsense_ipsec_phase2(string_table(phase2)),
+    )
+
+
+def plugins(size, rng):
+    '''Yield name, parsing time, discovery and check function of every plugin for a size'''
+    start = time.perf_counter()
+    sections = ipsec_sections(size, rng)
+    parsed = time.perf_counter() - start
+    yield 'opnsense_ipsec', parsed, lambda: opnsense_ipsec.discovery_opnsense_ipsec(**sections), \
+        lambda service: opnsense_ipsec.check_opnsense_ipsec(service.item, dict(service.parameters, version='discovered'), **sections)
+
+    child_sections = dict(
+        section_opnsense_ipsec=sections['section_opnsense_ipsec'],
+        section_opnsense_ipsec_phase2=sections['section_opnsense_ipsec_phase2'],
+    )
+    yield 'opnsense_ipsec_child', parsed, lambda: opnsense_ipsec.discovery_opnsense_ipsec_child(**child_sections), \
+        lambda service: opnsense_ipsec.check_opnsense_ipsec_child(service.item, **child_sections)
+
+    start = time.perf_counter()
+    vips = parse_jsonl(string_table(synthetic.vip_rows(size, rng)))
+    parsed = time.perf_counter() - start
+    yield 'opnsense_vip', parsed, lambda: opnsense_vip.discovery_opnsense_vip({'discover': 'all'}, vips), \
+        lambda service: opnsense_vip.check_opnsense_vip(service.item, service.parameters, vips)
+
+    start = time.perf_counter()
+    unbound = parse_json(string_table(synthetic.unbound(4, rng, query_types=size)))
+    parsed = time.perf_counter() - start
+    yield 'opnsense_unbound', parsed, lambda: opnsense_unbound.discovery_opnsense_unbound(unbound), \
+        lambda service: opnsense_unbound.check_opnsense_unbound({}, unbound)
+
+    start = time.perf_counter()
+    gateways = opnsense_gateway.parse_opnsense_gateway(string_table(synthetic.gateway_rows(size, rng)))
+    parsed = time.perf_counter() - start
+    yield 'opnsense_gateway', parsed, lambda: opnsense_gateway.discovery_opnsense_gateway(gateways), \
+        lambda service: opnsense_gateway.check_opnsense_gateway(service.item, {}, gateways)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, action='append', help='Entities per section. (Default: 10, 1000, 10000)')
+    parser.add_argument('--sample', type=int, default=200, help='Services checked per plugin and size. (Default: 200)')
+    parser.add_argument('--budget', type=float, default=10.0, help='Seconds of checks per plugin and size, at least one service is checked. (Default: 10)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated data. (Default: 0)')
+    args = parser.parse_args()
+
+    # The rates of unbound and IPsec need a value store outside of a check context
+    value_store = {}
+    for module in [opnsense_ipsec, opnsense_unbound]:
+        module.get_value_store = lambda: value_store
+
+    results = {}
+    for size in sorted(args.size or [10, 1000, 10000]):
+        for name, parsed, discovery, check in plugins(size, random.Random(args.seed)):
+            start = time.perf_counter()
+            services = list(discovery())
+            discovered = time.perf_counter() - start
+
+            step = max(len(services) / args.sample, 1)
+            sample = [services[int(i * step)] for i in range(min(len(services), args.sample))]
+            checked = 0
+            start = time.perf_counter()
+            for service in sample:
+                list(check(service))
+                checked += 1
+                if time.perf_counter() - start > args.budget:
+                    break
+            per_service = (time.perf_counter() - start) / max(checked, 1)
+            results.setdefault(name, []).append((size, parsed, discovered, len(services), checked, per_service))
+
+    print(f"{'plugin':>21} {'size':>6} {'parse ms':>9} {'discovery ms':>13} {'services':>9} {'per service ms':>15} {'cycle ms':>11} {'exponent':>9}")
+    for name, rows in results.items():
+        previous = None
+        for size, parsed, discovered, services, sampled, per_service in rows:
+            cycle = per_service * services * 1000
+            exponent = ''
+            if previous and previous[1] > 0 and per_service > 0 and size != previous[0]:
+                exponent = f"{math.log(per_service / previous[1]) / math.log(size / previous[0]):.2f}"
+            print(f"{name:>21} {size:>6} {parsed * 1000:>9.1f} {discovered * 1000:>13.1f} {services:>9} {per_service * 1000:>15.4f} "
+                  f"{('~' if sampled < services else '') + f'{cycle:.1f}':>11} {exponent:>9}")
+            previous = size, per_service
+
+
+if __name__ == '__main__':
+    main()
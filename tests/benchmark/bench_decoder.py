@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+'''Compare the JSON decoders on representative section payloads.
+
+Times the API response decoding of the agent (bytes) and parse_json /
+parse_jsonl of the check plugins (string table) for every decoder that
+can be imported.
+
+    python3 tests/benchmark/bench_decoder.py --rows 2000 --threads 50
+'''
+
+import argparse
+import json
+import timeit
+
+from cmk_addons.plugins.opnsense.lib import decoder, utils
+
+
+def unbound_stats(threads):
+    num = {'queries': 123456, 'queries_ip_ratelimited': 0, 'cachehits': 100000, 'cachemiss': 23456,
+           'prefetch': 12, 'expired': 0, 'recursivereplies': 23456, 'zero_ttl': 0}
+    recursion = {'time': {'avg': '0.052107', 'median': '0.0329'}}
+    stats = {f"thread{i}": {'num': num, 'requestlist': {'avg': '0.5', 'max': 12, 'overwritten': 0}, 'recursion': recursion}
+             for i in range(threads)}
+    stats['total'] = {'num': num, 'recursion': recursion}
+    stats['num'] = {'answer': {'rcode': {r: 42 for r in ['NOERROR', 'FORMERR', 'SERVFAIL', 'NXDOMAIN', 'NOTIMPL', 'REFUSED']}},
+                    'query': {'type': {t: 1000 for t in ['A', 'AAAA', 'PTR', 'MX', 'TXT', 'SRV', 'HTTPS', 'SOA']}}}
+    return {'status': 'ok', 'data': stats, 'time': {'now': '1735689600.123', 'up': '86400.5'}}
+
+
+def vip_rows(rows):
+    return [
+        {'interface': f"vlan{i // 250}", 'vhid': str(i % 250 + 1), 'advbase': '1', 'advskew': '0', 'mode': 'carp',
+         'status': 'MASTER', 'subnet': f"10.{i // 250}.{i % 250}.1", 'vhid_txt': f"{i % 250 + 1} (freq. 1/0)"}
+        for i in range(rows)
+    ]
+
+
+def phase2_rows(rows):
+    return [
+        {'ikeid': f"conn-{i // 2}", 'phase2desc': f"Tunnel {i // 2} Child {i % 2}", 'name': f"con{i // 2}-child{i % 2}",
+         'state': 'INSTALLED', 'local-ts': '10.0.0.0/24', 'remote-ts': f"172.16.{i % 250}.0/24", 'bytes-in': 1234567890,
+         'bytes-out': 987654321, 'packets-in': 123456, 'packets-out': 654321, 'install-time': 3600, 'rekey-time': 300}
+        for i in range(rows)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000, help='Rows of the VIP and phase2 sections. (Default: 2000)')
+    parser.add_argument('--threads', type=int, default=16, help='Unbound threads in the stats. (Default: 16)')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetitions, the best is reported. (Default: 5)')
+    parser.add_argument('--number', type=int, default=20, help='Calls per repetition. (Default: 20)')
+    args = parser.parse_args()
+
+    payloads = [
+        ('opnsense_unbound', 'parse_json', unbound_stats(args.threads)),
+        ('opnsense_vip', 'parse_jsonl', vip_rows(args.rows)),
+        ('opnsense_ipsec_phase2', 'parse_jsonl', phase2_rows(args.rows)),
+    ]
+    decoders = decoder.available_decoders()
+
+    def best(func):
+        return min(timeit.repeat(func, repeat=args.repeat, number=args.number)) / args.number * 1000
+
+    print(f"selected decoder: {next(n for n, d in decoders.items() if d is decoder.get_loads())}")
+    print(f"{'section':>22} {'parser':>12} {'kbytes':>8} " + ' '.join(f"{name + ' ms':>10}" for name in decoders) + f" {'speedup':>8}")
+    for section, parse, data in payloads:
+        if parse == 'parse_json':
+            string_table = [[json.dumps(data)]]
+            response = string_table[0][0].encode()
+        else:
+            string_table = [[json.dumps(row)] for row in data]
+            response = json.dumps({'rows': data, 'total': len(data)}).encode()
+        size = len(response) / 1024
+
+        for parser_name, call in [
+            ('response', lambda loads: loads(response)),
+            (parse, lambda loads: getattr(utils, parse)(string_table)),
+        ]:
+            timings = {}
+            for name, loads in decoders.items():
+                utils.get_loads = lambda: loads
+                timings[name] = best(lambda: call(loads))
+            utils.get_loads = decoder.get_loads
+            speedup = timings['json'] / min(timings.values())
+            print(f"{section:>22} {parser_name:>12} {size:>8.0f} " + ' '.join(f"{t:>10.3f}" for t in timings.values()) + f" {speedup:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+'''Measure request count and latency of the paginated searches by page size.
+
+    python3 tests/benchmark/bench_page_size.py --rows 5000 --latency 0.02
+'''
+
+import argparse
+import random
+import time
+
+from cmk_addons.plugins.opnsense.lib.agent import AgentOpnSense
+import synthetic
+from opnsense_stub import OPNsenseStub
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000, help='Rows per table. (Default: 2000)')
+    parser.add_argument('--latency', type=float, default=0.02, help='Latency per request in seconds. (Default: 0.02)')
+    parser.add_argument('--server-page-size', type=int, default=25, help='Default page size of the stub. (Default: 25)')
+    parser.add_argument('--page-size', type=int, action='append', help='Page sizes to compare. (Default: server, 100, 500, -1)')
+    parser.add_argument('--page-fanout', type=int, default=1, help='Concurrent pages. (Default: 1)')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    connections, _, phase1, phase2 = synthetic.ipsec(args.rows // 2, 2, 0.0, rng)
+
+    print(f"{'page size':>10} {'section':>8} {'requests':>9} {'seconds':>9}")
+    with OPNsenseStub(latency=args.latency, default_page_size=args.server_page_size) as stub:
+        stub.add_search('diagnostics/interface/get_vip_status', synthetic.vip_rows(args.rows, rng), carp={'demotion': '0'})
+        stub.add_search('ipsec/connections/search_connection', connections)
+        stub.add_search('ipsec/sessions/search_phase1', phase1)
+        stub.add_search('ipsec/sessions/search_phase2', phase2)
+
+        for page_size in args.page_size or [None, 100, 500, -1]:
+            argv = ['-U', stub.url, '-k', 'key', '-s', 'secret', '--page-fanout', str(args.page_fanout), '--ipsec-child', 'skip', '--ipsec-phase2', 'bulk']
+            if page_size is not None:
+                argv += ['--page-size', str(page_size)]
+            for part in ['vip', 'ipsec']:
+                agent = AgentOpnSense()
+                agent.args = agent.parse_arguments(argv)
+                stub.requests.clear()
+                start = time.perf_counter()
+                agent.materialize(agent.sections(part))
+                duration = time.perf_counter() - start
+                print(f"{'server' if page_size is None else page_size:>10} {part:>8} {sum(stub.requests.values()):>9} {duration:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
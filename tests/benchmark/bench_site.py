@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+'''Simulate the load of many firewalls on a Checkmk site.
+
+Serves a synthetic firewall from --stubs stub processes and polls it as
+--hosts firewalls, the hosts are spread over the stubs. The processes
+mode starts one agent_opnsense per host like the Checkmk fetchers do,
+up to --concurrency at a time. The collect mode polls all hosts from a
+single agent_opnsense --collect.
+
+Reported per mode are the wall time of the whole cycle, p50, p99 and
+max run time of a host, the CPU seconds of all agent processes and the
+cores they keep busy at a check --interval, the peak resident memory
+and open file descriptors summed over all processes running at the
+same time and of the largest single process, and the failed hosts.
+The memory and file descriptors are sampled from /proc (Linux only).
+In collect mode the run time of a host is its time within the
+collector. Arguments after -- are passed to the agent.
+
+    python3 tests/benchmark/bench_site.py --hosts 500 --stubs 8 --latency 0.02 -- --workers 4
+'''
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+import synthetic
+from opnsense_stub import stub_process
+
+AGENT = Path(__file__).resolve().parents[2] / 'libexec' / 'agent_opnsense'
+ALL_PARTS = ['--firewall', '--firmware', '--vip', '--gateway', '--ipsec', '--unbound', '--snapshot', '--ssl']
+RESULT = re.compile(rb'<<<opnsense_agent:sep\(0\)>>>\n(.*)\n<<<opnsense_agent_stats:sep\(0\)>>>\n(.*)\n')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def host_results(output):
+    '''Return the errors and wall time of every host in the agent output'''
+    return [(json.loads(errors)['errors'], json.loads(stats)['wall_time']) for errors, stats in RESULT.findall(output)]
+
+
+class Process:
+    '''An agent process, its output and resource usage once it exited'''
+
+    def __init__(self, argv, sampler, done=None):
+        self.sampler = sampler
+        self.done = done
+        self.started = time.monotonic()
+        self.proc = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        sampler.pids.add(self.proc.pid)
+        self.thread = threading.Thread(target=self.wait, daemon=True)
+        self.thread.start()
+
+    def wait(self):
+        self.output = self.proc.stdout.read()
+        self.proc.stdout.close()
+        self.sampler.pids.discard(self.proc.pid)
+        # wait4 instead of Popen.wait for the rusage of the process
+        _, status, self.usage = os.wait4(self.proc.pid, 0)
+        self.proc.returncode = os.waitstatus_to_exitcode(status)
+        self.seconds = time.monotonic() - self.started
+        if self.done is not None:
+            self.done.release()
+
+    @property
+    def cpu_seconds(self):
+        return self.usage.ru_utime + self.usage.ru_stime
+
+    @property
+    def max_rss(self):
+        return self.usage.ru_maxrss * 1024
+
+
+class Sampler(threading.Thread):
+    '''Sample the summed memory and file descriptors of the running agents'''
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.pids = set()
+        self.stopped = threading.Event()
+        self.peak_rss = self.peak_fds = self.max_fds = 0
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        rss = fds = 0
+        for pid in list(self.pids):
+            try:
+                count = len(os.listdir(f"/proc/{pid}/fd"))
+                with open(f"/proc/{pid}/statm") as fh:
+                    pages = int(fh.read().split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            self.max_fds = max(self.max_fds, count)
+            fds += count
+            rss += pages * PAGE_SIZE
+        self.peak_rss = max(self.peak_rss, rss)
+        self.peak_fds = max(self.peak_fds, fds)
+
+    def __enter__(self):
+        if os.path.isdir('/proc'):
+            self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+
+
+def run_processes(urls, hosts, concurrency, agent_args):
+    slots = threading.BoundedSemaphore(concurrency)
+    processes = []
+    with Sampler() as sampler:
+        start = time.monotonic()
+        for i in range(hosts):
+            slots.acquire()
+            argv = [sys.executable, str(AGENT), '-U', urls[i % len(urls)], '-k', 'key', '-s', 'secret', *agent_args]
+            processes.append(Process(argv, sampler, slots))
+        for process in processes:
+            process.thread.join()
+        wall = time.monotonic() - start
+    runs = [p.seconds for p in processes]
+    failed = sum(1 for p in processes if p.proc.returncode != 0 or any(errors for errors, _ in host_results(p.output)))
+    return wall, runs, processes, sampler, failed
+
+
+def run_collect(urls, hosts, workers, agent_args):
+    with tempfile.TemporaryDirectory() as tmp, Sampler() as sampler:
+        hosts_file = Path(tmp) / 'hosts.json'
+        hosts_file.write_text(json.dumps([
+            {'host': f"fw{i}", 'url': urls[i % len(urls)], 'key': 'key', 'secret': 'secret'}
+            for i in range(hosts)
+        ]))
+        start = time.monotonic()
+        process = Process([sys.executable, str(AGENT), '--collect', str(hosts_file), '--workers', str(workers), *agent_args], sampler)
+        process.thread.join()
+        wall = time.monotonic() - start
+    results = host_results(process.output)
+    failed = hosts - len(results) + sum(1 for errors, _ in results if errors)
+    if process.proc.returncode != 0:
+        failed = hosts
+    return wall, [seconds for _, seconds in results], [process], sampler, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hosts', type=int, default=100, help='Simulated firewalls. (Default: 100)')
+    parser.add_argument('--stubs', type=int, default=4, help='Stub processes serving the firewalls. (Default: 4)')
+    parser.add_argument('--scale', choices=list(synthetic.SCALES), default='small', help='Size of the firewalls. (Default: small)')
+    parser.add_argument('--latency', type=float, default=0.005, help='Latency per request in seconds. (Default: 0.005)')
+    parser.add_argument('--mode', choices=['processes', 'collect'], action='append', help='Modes to run. (Default: both)')
+    parser.add_argument('--concurrency', type=int, help='Agent processes running at the same time. (Default: --hosts)')
+    parser.add_argument('--collect-workers', type=int, default=32, help='--workers of the collector. (Default: 32)')
+    parser.add_argument('--interval', type=float, default=60, help='Check interval to compute the busy cores for. (Default: 60)')
+    parser.add_argument('agent_args', nargs=argparse.REMAINDER, help='Arguments for the agent after --.')
+    args = parser.parse_args()
+    agent_args = [*ALL_PARTS, *(a for a in args.agent_args if a != '--')]
+
+    responses = synthetic.firewall(**synthetic.SCALES[args.scale])
+    with ExitStack() as stack:
+        urls = [stack.enter_context(stub_process(responses, args.latency)) for _ in range(args.stubs)]
+        print(f"{args.hosts} {args.scale} firewalls on {args.stubs} stubs, agent arguments: {' '.join(agent_args)}")
+        print(f"{'mode':>10} {'wall s':>7} {'p50 s':>7} {'p99 s':>7} {'max s':>7} {'cpu s':>8} {'cores':>6} "
+              f"{'rss MiB':>8} {'max MiB':>8} {'fds':>6} {'max fds':>8} {'failed':>7}")
+        for mode in args.mode or ['processes', 'collect']:
+            if mode == 'processes':
+                wall, runs, processes, sampler, failed = run_processes(urls, args.hosts, args.concurrency or args.hosts, agent_args)
+            else:
+                wall, runs, processes, sampler, failed = run_collect(urls, args.hosts, args.collect_workers, agent_args)
+            cpu = sum(p.cpu_seconds for p in processes)
+            p50, p99 = (statistics.quantiles(runs, n=100, method='inclusive')[i] for i in (49, 98)) if len(runs) > 1 else (max(runs, default=0),) * 2
+            print(f"{mode:>10} {wall:>7.2f} {p50:>7.3f} {p99:>7.3f} {max(runs, default=0):>7.3f} {cpu:>8.2f} {cpu / args.interval:>6.2f} "
+                  f"{sampler.peak_rss / 2**20:>8.0f} {max(p.max_rss for p in processes) / 2**20:>8.1f} "
+                  f"{sampler.peak_fds:>6} {sampler.max_fds:>8} {failed:>7}")
+
+
+if __name__ == '__main__':
+    main()
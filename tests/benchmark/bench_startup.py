@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+'''Measure the startup of the special agent with python -X importtime.
+
+Runs the agent with --help and with a single section against the local
+stub and reports the median import and wall time of each scenario. The
+import time includes the Checkmk special agent modules every run needs,
+their share including the modules they import is reported separately as
+it depends on the Checkmk version. Exits non-zero if the median import
+time of the extension without the Checkmk modules exceeds its budget.
+
+    python3 tests/benchmark/bench_startup.py --runs 10 --help-budget 100 --section-budget 250
+'''
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from opnsense_stub import OPNsenseStub
+
+AGENT = Path(__file__).resolve().parents[2] / 'libexec' / 'agent_opnsense'
+
+
+def import_times(stderr):
+    '''Return the cumulative import time in ms of the top level imports by module and of the outermost cmk imports
+
+    Children are listed before their parent, the lines are walked in
+    reverse to know if a cmk module was imported by another cmk module.
+    The cumulative time of the outermost ones includes the third party
+    modules the Checkmk modules import.
+    '''
+    times, cmk, parents = {}, 0.0, []
+    for line in reversed(stderr.splitlines()):
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.removeprefix('import time:').split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        while parents and parents[-1][0] >= depth:
+            parents.pop()
+        in_cmk = bool(parents) and parents[-1][1]
+        is_cmk = name == 'cmk' or name.startswith('cmk.')
+        if is_cmk and not in_cmk:
+            cmk += int(cumulative) / 1000
+        parents.append((depth, in_cmk or is_cmk))
+        if depth == 0:
+            times[name] = int(cumulative) / 1000
+    return times, cmk
+
+
+def measure(args, runs):
+    totals, cmks, walls, modules = [], [], [], {}
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-X', 'importtime', str(AGENT), *args], capture_output=True, text=True)
+        walls.append((time.perf_counter() - start) * 1000)
+        times, cmk = import_times(proc.stderr)
+        totals.append(sum(times.values()))
+        cmks.append(cmk)
+        for name, ms in times.items():
+            modules.setdefault(name, []).append(ms)
+    slowest = sorted(modules.items(), key=lambda m: statistics.median(m[1]), reverse=True)[:5]
+    return statistics.median(totals), statistics.median(cmks), statistics.median(walls), [(name, statistics.median(ms)) for name, ms in slowest]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='Runs per scenario. (Default: 10)')
+    parser.add_argument('--help-budget', type=float, default=100, help='Import time budget of --help without the cmk modules in ms. (Default: 100)')
+    parser.add_argument('--section-budget', type=float, default=250, help='Import time budget of a single section run without the cmk modules in ms. (Default: 250)')
+    args = parser.parse_args()
+
+    with OPNsenseStub() as stub:
+        stub.add_static('core/firmware/status', {'product': {'product_version': '25.1'}})
+        scenarios = [
+            ('--help', ['--help'], args.help_budget),
+            ('--firmware', ['-U', stub.url, '-k', 'key', '-s', 'secret', '--firmware'], args.section_budget),
+        ]
+
+        failed = False
+        print(f"{'scenario':>10} {'import ms':>10} {'cmk ms':>8} {'budget':>8} {'wall ms':>9}  slowest imports")
+        for name, agent_args, budget in scenarios:
+            imports, cmk, wall, slowest = measure(agent_args, args.runs)
+            failed |= imports - cmk > budget
+            print(f"{name:>10} {imports:>10.1f} {cmk:>8.1f} {budget:>8.0f} {wall:>9.1f}  {', '.join(f'{m} {ms:.1f}' for m, ms in slowest)}")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+'''Local stand-in for the OPNsense API used by the benchmarks and fault tests.'''
+
+import json
+import multiprocessing
+import socket
+import struct
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Search endpoints with the payload key and row field the agent filters by
+SEARCHES = {
+    'diagnostics/interface/get_vip_status': (None, None),
+    'ipsec/connections/search_connection': (None, None),
+    'ipsec/connections/search_child': ('connection', 'connection'),
+    'ipsec/sessions/search_phase1': (None, None),
+    'ipsec/sessions/search_phase2': ('id', 'ikeid'),
+}
+
+
+def search(rows, payload, default_page_size):
+    row_count = int(payload.get('rowCount', default_page_size))
+    current = int(payload.get('current', 1))
+    if row_count < 0:
+        page = rows
+    else:
+        page = rows[(current - 1) * row_count:current * row_count]
+    return {'rows': page, 'rowCount': len(page), 'total': len(rows), 'current': current}
+
+
+class OPNsenseStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_api({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.handle_api(json.loads(self.rfile.read(length) or b'{}'))
+
+    def handle_api(self, payload):
+        with self.server.worker():
+            self.respond(payload)
+
+    def respond(self, payload):
+        command = self.path.split('?')[0].removeprefix('/api/')
+        self.server.requests[command] += 1
+        endpoint = self.server.endpoints.get(command)
+        fault = self.server.faults.get(command, {})
+        latency = self.server.latency + fault.get('latency', 0.0)
+        if latency:
+            time.sleep(latency)
+        kind = fault.get('fault')
+        if kind == 'stall':
+            self.server.released.wait()
+            self.close_connection = True
+            return
+        if kind == 'reset':
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.connection.close()
+            self.close_connection = True
+            return
+        if kind == 'status':
+            self.send_error(fault['status'])
+            return
+        if endpoint is None:
+            self.send_error(404)
+            return
+        body = json.dumps(endpoint(payload)).encode()
+        length = len(body)
+        if kind == 'truncate':
+            body = body[:len(body) // 2]
+            length = len(body)
+        elif kind == 'cut':
+            body = body[:len(body) // 2]
+            self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+        if kind == 'trickle':
+            for i in range(len(body)):
+                self.wfile.write(body[i:i + 1])
+                self.wfile.flush()
+                time.sleep(fault['interval'])
+        else:
+            self.wfile.write(body)
+
+
+class OPNsenseStub(ThreadingHTTPServer):
+    '''OPNsense API stub serving search tables in pages
+
+    Endpoints are registered by their path below /api/ and receive the
+    decoded JSON payload. Searches use the paging of the OPNsense grid
+    with default_page_size rows unless the client sends rowCount. With
+    workers only that many requests are served at the same time, like
+    the PHP workers of OPNsense, the others queue.
+
+    add_fault makes an endpoint misbehave, after waiting latency seconds:
+      stall     never answer until the stub is closed
+      reset     reset the connection without an answer
+      status    answer with the HTTP error status
+      truncate  answer with the first half of the JSON
+      cut       close the connection after half of the announced body
+      trickle   send the body one byte every interval seconds
+    '''
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, default_page_size=25, workers=None):
+        super().__init__(('127.0.0.1', 0), OPNsenseStubHandler)
+        self.latency = latency
+        self.default_page_size = default_page_size
+        self.workers = threading.BoundedSemaphore(workers) if workers else None
+        self.in_flight = self.peak_in_flight = 0
+        self._lock = threading.Lock()
+        self.endpoints = {}
+        self.faults = {}
+        self.requests = Counter()
+        self.released = threading.Event()
+
+    @contextmanager
+    def worker(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            if self.workers is None:
+                yield
+            else:
+                with self.workers:
+                    yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/api/"
+
+    def add_search(self, command, rows, filter_key=None, filter_field=None, **extra):
+        def endpoint(payload):
+            selected = rows
+            if filter_key and payload.get(filter_key):
+                selected = [r for r in rows if r[filter_field] == payload[filter_key]]
+            return dict(search(selected, payload, self.default_page_size), **extra)
+        self.endpoints[command] = endpoint
+
+    def add_static(self, command, data):
+        self.endpoints[command] = lambda payload: data
+
+    def add_fault(self, command, fault=None, latency=0.0, status=503, interval=0.1):
+        self.faults[command] = dict(fault=fault, latency=latency, status=status, interval=interval)
+
+    def add_firewall(self, responses):
+        '''Serve the responses by endpoint of e.g. synthetic.firewall()'''
+        for command, data in responses.items():
+            if command not in SEARCHES:
+                self.add_static(command, data)
+            elif command == 'diagnostics/interface/get_vip_status':
+                self.add_search(command, data, carp={'demotion': '0', 'allow': '1', 'maintenancemode': False})
+            else:
+                self.add_search(command, data, *SEARCHES[command])
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.released.set()
+        self.shutdown()
+        self.server_close()
+
+
+def serve(responses, latency, page_size, workers, urls):
+    with OPNsenseStub(latency=latency, default_page_size=page_size, workers=workers) as stub:
+        stub.add_firewall(responses)
+        urls.put(stub.url)
+        threading.Event().wait()
+
+
+@contextmanager
+def stub_process(responses, latency=0.0, page_size=25, workers=None):
+    '''Serve the responses of a firewall from its own process and yield its URL
+
+    The stub does not compete with the agent for the GIL this way.
+    '''
+    urls = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(responses, latency, page_size, workers, urls), daemon=True)
+    process.start()
+    try:
+        yield urls.get(timeout=60)
+    finally:
+        process.terminate()
+        process.join()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+'''Synthetic OPNsense API data for the benchmarks.
+
+firewall() returns the responses of all endpoints used by the agent for
+a firewall of the given size. The data is deterministic for a seed and
+follows the fields the check plugins read, so it can also be fed
+through the parse and check functions.
+'''
+
+import random
+import time
+
+
+def search_result(rows):
+    return {'rows': rows, 'rowCount': len(rows), 'total': len(rows), 'current': 1}
+
+
+def vip_rows(count, rng):
+    return [
+        {
+            'interface': f"vlan{i // 250}",
+            'vhid': str(i % 250 + 1),
+            'advbase': '1',
+            'advskew': '0',
+            'mode': 'carp',
+            'status': 'MASTER' if rng.random() > 0.01 else 'BACKUP',
+            'status_txt': 'MASTER',
+            'subnet': f"10.{i // 250 % 256}.{i % 250}.1",
+            'subnet_bits': '24',
+            'vhid_txt': f"{i % 250 + 1} (freq. 1/0)",
+        }
+        for i in range(count)
+    ]
+
+
+def gateway_rows(count, rng):
+    return [
+        {
+            'name': f"GW{i}",
+            'address': f"192.0.2.{i + 1}",
+            'status': 'none',
+            'status_translated': 'Online',
+            'loss': f"{rng.choice([0.0, 0.0, 0.0, 1.0]):.1f} %",
+            'delay': f"{rng.uniform(0.5, 30):.3f} ms",
+            'stddev': f"{rng.uniform(0.01, 3):.3f} ms",
+            'monitor': f"192.0.2.{i + 1}",
+        }
+        for i in range(count)
+    ]
+
+
+def ipsec(tunnels, children, disconnected, rng):
+    connections, childs, phase1, phase2 = [], [], [], []
+    for i in range(tunnels):
+        uuid = f"{i:08x}-0000-4000-8000-{i:012x}"
+        connected = rng.random() >= disconnected
+        connections.append({
+            'uuid': uuid,
+            'description': f"Tunnel {i}",
+            'enabled': '1',
+            'local_addrs': '198.51.100.1',
+            'remote_addrs': f"203.0.113.{i % 250 + 1}",
+            'version': '2',
+        })
+        phase1.append({
+            'name': uuid,
+            'phase1desc': f"Tunnel {i}",
+            'connected': connected,
+            'version': 'IKEv2',
+            'install-time': str(rng.randrange(86400)),
+            'bytes-in': str(rng.randrange(10**10)),
+            'bytes-out': str(rng.randrange(10**10)),
+            'packets-in': str(rng.randrange(10**7)),
+            'packets-out': str(rng.randrange(10**7)),
+        })
+        for c in range(children):
+            description = f"Tunnel {i} Child {c}"
+            childs.append({
+                'uuid': f"{i:08x}-{c:04x}-4000-8000-{i:012x}",
+                'connection': uuid,
+                'description': description,
+                'enabled': '1',
+                'local_ts': '10.0.0.0/24',
+                'remote_ts': f"172.{16 + i // 256 % 16}.{i % 256}.0/24",
+            })
+            if connected:
+                phase2.append({
+                    'ikeid': uuid,
+                    'phase2desc': description,
+                    'name': f"con{i}-child{c}",
+                    'state': 'INSTALLED',
+                    'protocol': 'ESP',
+                    'encr-alg': 'AES_GCM_16',
+                    'encr-keysize': '256',
+                    'integ-alg': None,
+                    'dh-group': 'CURVE_25519',
+                    'local-ts': ['10.0.0.0/24'],
+                    'remote-ts': [f"172.{16 + i // 256 % 16}.{i % 256}.0/24"],
+                    'install-time': str(rng.randrange(3600)),
+                    'rekey-time': str(rng.randrange(3600)),
+                    'life-time': str(rng.randrange(3600, 7200)),
+                    'bytes-in': str(rng.randrange(10**9)),
+                    'bytes-out': str(rng.randrange(10**9)),
+                })
+    return connections, childs, phase1, phase2
+
+
+QUERY_TYPES = ['A', 'AAAA', 'PTR', 'MX', 'TXT', 'SRV', 'HTTPS', 'SOA']
+RCODES = ['NOERROR', 'FORMERR', 'SERVFAIL', 'NXDOMAIN', 'NOTIMPL', 'REFUSED']
+
+
+def unbound(threads, rng, query_types=len(QUERY_TYPES)):
+    def counters():
+        queries = rng.randrange(10**6)
+        hits = rng.randrange(queries + 1)
+        return {
+            'num': {'queries': str(queries), 'cachehits': str(hits), 'cachemiss': str(queries - hits),
+                    'prefetch': '0', 'expired': '0', 'recursivereplies': str(queries - hits)},
+            'requestlist': {'avg': '0.5', 'max': '12', 'overwritten': '0', 'exceeded': '0', 'current': {'all': '0', 'user': '0'}},
+            'recursion': {'time': {'avg': f"{rng.uniform(0.01, 0.2):.6f}", 'median': f"{rng.uniform(0.01, 0.1):.6f}"}},
+        }
+    types = QUERY_TYPES[:query_types] + [f"TYPE{i}" for i in range(len(QUERY_TYPES), query_types)]
+    data = {f"thread{i}": counters() for i in range(threads)}
+    data['total'] = counters()
+    data['num'] = {
+        'query': {'type': {t: str(rng.randrange(10**5)) for t in types}},
+        'answer': {'rcode': {r: str(rng.randrange(10**5)) for r in RCODES}},
+    }
+    for cache in ['msg', 'rrset', 'infra', 'key']:
+        data[cache] = {'cache': {'count': str(rng.randrange(10**5))}}
+    return {'status': 'ok', 'data': data, 'time': {'now': f"{time.time():.6f}", 'up': '86400.5'}}
+
+
+def firmware():
+    return {
+        'product_id': 'opnsense',
+        'product_version': '25.1.5',
+        'last_check': time.strftime('%a %b %d %X %Z %Y'),
+        'status': 'none',
+        'status_msg': 'There are no updates available on the selected mirror.',
+        'product': {
+            'product_series': '25.1',
+            'product_nickname': 'Ultimate Unicorn',
+            'product_check': {'upgrade_packages': []},
+        },
+    }
+
+
+def snapshot_rows(count, rng):
+    now = int(time.time())
+    return [
+        {
+            'name': 'default' if i == 0 else f"snapshot-{i}",
+            'uuid': f"{i:08x}",
+            'active': 'NR' if i == 0 else '-',
+            'mountpoint': '/' if i == 0 else '-',
+            'size': f"{rng.uniform(0.5, 4):.1f}G",
+            'created': now - i * 86400,
+        }
+        for i in range(count)
+    ]
+
+
+def cert_rows(count, rng):
+    now = int(time.time())
+    return [
+        {
+            'descr': f"Certificate {i}",
+            'commonname': f"host{i}.example.com",
+            'caref': 'ca-1',
+            'valid_from': str(now - rng.randrange(365 * 86400)),
+            'valid_to': str(now + rng.randrange(365 * 86400)),
+            'is_user': '1' if i % 5 == 4 else '0',
+            'in_use': '1' if i % 3 else '0',
+        }
+        for i in range(count)
+    ]
+
+
+def firewall(vips=100, tunnels=50, children=2, gateways=4, certs=20, snapshots=5, unbound_threads=4, disconnected=0.05, seed=0):
+    '''Return the responses of a synthetic firewall by endpoint'''
+    rng = random.Random(seed)
+    connections, childs, phase1, phase2 = ipsec(tunnels, children, disconnected, rng)
+    return {
+        'diagnostics/firewall/pf_states': {'current': str(rng.randrange(10**5)), 'limit': '1000000'},
+        'firewall/alias/get_table_size': {'used': rng.randrange(10**4), 'size': 200000},
+        'core/firmware/status': firmware(),
+        'diagnostics/interface/get_vip_status': vip_rows(vips, rng),
+        'routes/gateway/status': {'status': 'ok', 'items': gateway_rows(gateways, rng)},
+        'ipsec/connections/search_connection': connections,
+        'ipsec/connections/search_child': childs,
+        'ipsec/sessions/search_phase1': phase1,
+        'ipsec/sessions/search_phase2': phase2,
+        'unbound/diagnostics/stats': unbound(unbound_threads, rng),
+        'core/snapshots/search': search_result(snapshot_rows(snapshots, rng)),
+        'trust/cert/search': search_result(cert_rows(certs, rng)),
+    }
+
+
+SCALES = {
+    'small': dict(vips=10, tunnels=5, certs=10),
+    'medium': dict(vips=500, tunnels=200, certs=50),
+    'large': dict(vips=5000, tunnels=2000, certs=200),
+}
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import pytest  # type: ignore[import]
+from cmk.agent_based.v2 import (
+    Result,
+    Service,
+    State,
+)
+from cmk_addons.plugins.opnsense.agent_based import opnsense_agent
+
+
+@pytest.mark.parametrize('section, result', [
+    (None, []),
+    ({'errors': {}}, [Service()]),
+])
+def test_discovery_opnsense_agent(section, result):
+    assert list(opnsense_agent.discovery_opnsense_agent(section)) == result
+
+
+@pytest.mark.parametrize('section, result', [
+    ({'errors': {}}, [Result(state=State.OK, summary='All sections fetched')]),
+    (
+        {'errors': {'unbound': 'Read timeout after 10s when trying to GET https://opnsense.local/api/unbound/diagnostics/stats'}},
+        [Result(state=State.CRIT, summary='Section unbound failed', details='Section unbound failed: Read timeout after 10s when trying to GET https://opnsense.local/api/unbound/diagnostics/stats')],
+    ),
+])
+def test_check_opnsense_agent(section, result):
+    assert list(opnsense_agent.check_opnsense_agent(section)) == result
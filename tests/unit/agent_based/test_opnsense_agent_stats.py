@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import pytest  # type: ignore[import]
+from cmk.agent_based.v2 import (
+    Metric,
+    Result,
+    Service,
+    State,
+)
+from cmk_addons.plugins.opnsense.agent_based import opnsense_agent_stats
+
+EXAMPLE_SECTION = {
+    'wall_time': 2.5,
+    'cpu_time': 0.25,
+    'sections': {'firmware': 0.5, 'unbound': 2.0},
+    'endpoints': {
+        'core/firmware/status': {'requests': 1, 'cached': 0, 'pages': 0, 'seconds': 0.5, 'max_seconds': 0.5, 'bytes': 1024, 'status': {'200': 1}},
+        'unbound/diagnostics/stats': {'requests': 2, 'cached': 0, 'pages': 0, 'seconds': 2.0, 'max_seconds': 1.5, 'bytes': 2048, 'status': {'200': 1, 'error': 1}},
+    },
+}
+
+
+@pytest.mark.parametrize('section, result', [
+    (None, []),
+    (EXAMPLE_SECTION, [Service()]),
+])
+def test_discovery_opnsense_agent_stats(section, result):
+    assert list(opnsense_agent_stats.discovery_opnsense_agent_stats(section)) == result
+
+
+@pytest.mark.parametrize('params, result', [
+    ({}, [
+        Result(state=State.OK, summary='Runtime: 2 seconds 500 milliseconds'),
+        Metric('opnsense_agent_runtime', 2.5),
+        Result(state=State.OK, summary='CPU time: 250 milliseconds 0 microseconds'),
+        Metric('opnsense_agent_cpu_time', 0.25),
+        Result(state=State.OK, summary='Requests: 3'),
+        Metric('opnsense_agent_requests', 3.0),
+        Result(state=State.OK, summary='Received: 3.00 KiB'),
+        Metric('opnsense_agent_received', 3072.0),
+        Result(state=State.OK, notice='Section firmware: 500 milliseconds 0 microseconds'),
+        Metric('opnsense_agent_section_firmware', 0.5),
+        Result(state=State.OK, notice='Section unbound: 2 seconds 0 milliseconds'),
+        Metric('opnsense_agent_section_unbound', 2.0),
+        Result(state=State.OK, notice='unbound/diagnostics/stats: 2 requests in 2 seconds 0 milliseconds (max 1 second 500 milliseconds), 2.00 KiB, 0 pages, 0 cached, status 200: 1, error: 1'),
+        Result(state=State.OK, notice='core/firmware/status: 1 requests in 500 milliseconds 0 microseconds (max 500 milliseconds 0 microseconds), 1.00 KiB, 0 pages, 0 cached, status 200: 1'),
+    ]),
+    ({'runtime': ('fixed', (2.0, 3.0)), 'section_time': ('fixed', (1.0, 1.5))}, [
+        Result(state=State.WARN, summary='Runtime: 2 seconds 500 milliseconds (warn/crit at 2 seconds 0 milliseconds/3 seconds 0 milliseconds)'),
+        Metric('opnsense_agent_runtime', 2.5, levels=(2.0, 3.0)),
+        Result(state=State.OK, summary='CPU time: 250 milliseconds 0 microseconds'),
+        Metric('opnsense_agent_cpu_time', 0.25),
+        Result(state=State.OK, summary='Requests: 3'),
+        Metric('opnsense_agent_requests', 3.0),
+        Result(state=State.OK, summary='Received: 3.00 KiB'),
+        Metric('opnsense_agent_received', 3072.0),
+        Result(state=State.OK, notice='Section firmware: 500 milliseconds 0 microseconds'),
+        Metric('opnsense_agent_section_firmware', 0.5, levels=(1.0, 1.5)),
+        Result(state=State.CRIT, summary='Section unbound: 2 seconds 0 milliseconds (warn/crit at 1 second 0 milliseconds/1 second 500 milliseconds)'),
+        Metric('opnsense_agent_section_unbound', 2.0, levels=(1.0, 1.5)),
+        Result(state=State.OK, notice='unbound/diagnostics/stats: 2 requests in 2 seconds 0 milliseconds (max 1 second 500 milliseconds), 2.00 KiB, 0 pages, 0 cached, status 200: 1, error: 1'),
+        Result(state=State.OK, notice='core/firmware/status: 1 requests in 500 milliseconds 0 microseconds (max 500 milliseconds 0 microseconds), 1.00 KiB, 0 pages, 0 cached, status 200: 1'),
+    ]),
+])
+def test_check_opnsense_agent_stats(params, result):
+    assert list(opnsense_agent_stats.check_opnsense_agent_stats(params, EXAMPLE_SECTION)) == result
+
+
+def test_check_opnsense_agent_stats_concurrency():
+    section = dict(EXAMPLE_SECTION, concurrency={'limit': 3, 'maximum': 16, 'peak': 10, 'decreases': 2})
+    results = list(opnsense_agent_stats.check_opnsense_agent_stats({}, section))
+    assert Result(state=State.OK, notice='Adaptive concurrency: 3 of 16 requests (peak 10, decreased 2 times)') in results
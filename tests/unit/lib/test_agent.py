@@ -0,0 +1,818 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import datetime
+import json
+import os
+import pstats
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import pytest  # type: ignore[import]
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from itertools import takewhile
+from cmk.special_agents.v0_unstable.agent_common import CannotRecover
+from cmk_addons.plugins.opnsense.lib import decoder
+from cmk_addons.plugins.opnsense.lib.agent import AgentOpnSense, DEADLINE, OSAPI
+from cmk_addons.plugins.opnsense.lib.cache import JSONCache
+
+URL = 'https://opnsense.local/api'
+ALL_PARTS = ['--firewall', '--firmware', '--vip', '--gateway', '--ipsec', '--unbound', '--snapshot', '--ssl']
+
+EXAMPLE_CONNECTIONS = [
+    {'uuid': 'conn-1', 'description': 'IPSec1', 'enabled': '1'},
+    {'uuid': 'conn-2', 'description': 'IPSec2', 'enabled': '1'},
+    {'uuid': 'conn-3', 'description': 'IPSec3', 'enabled': '0'},
+]
+
+EXAMPLE_CHILDS = [
+    {'uuid': 'child-1', 'connection': 'conn-1', 'description': 'IPSec1 Child', 'enabled': '1'},
+    {'uuid': 'child-2', 'connection': 'conn-2', 'description': 'IPSec2 Child', 'enabled': '1'},
+    {'uuid': 'child-3', 'connection': 'conn-2', 'description': 'IPSec2 Disabled', 'enabled': '0'},
+]
+
+EXAMPLE_PHASE1 = [
+    {'name': 'conn-1', 'phase1desc': 'IPSec1', 'connected': True},
+    {'name': 'conn-2', 'phase1desc': 'IPSec2', 'connected': True},
+]
+
+EXAMPLE_PHASE2 = [
+    {'ikeid': 'conn-1', 'phase2desc': 'IPSec1 Child', 'state': 'INSTALLED'},
+    {'ikeid': 'conn-2', 'phase2desc': 'IPSec2 Child', 'state': 'INSTALLED'},
+    {'ikeid': 'conn-2', 'phase2desc': 'IPSec2 Child', 'state': 'REKEYED'},
+]
+
+EXAMPLE_CERTS = [
+    {'descr': 'Web GUI', 'valid_from': '1700000000', 'valid_to': '1800000000', 'commonname': 'opnsense.local', 'caref': 'ca', 'is_user': '0', 'in_use': '1'},
+    {'descr': 'User', 'valid_from': '1700000000', 'valid_to': '1800000000', 'commonname': 'user', 'caref': 'ca', 'is_user': '1', 'in_use': '1'},
+    {'descr': 'Unused', 'valid_from': '1700000000', 'valid_to': '1800000000', 'commonname': 'unused', 'caref': 'ca', 'is_user': '0', 'in_use': '0'},
+]
+
+
+def search_result(rows):
+    return {'rows': rows, 'rowCount': len(rows), 'total': len(rows), 'current': 1}
+
+
+def json_callback(rows, field=None, param=None):
+    def callback(request, context):
+        if field is None or param not in request.json():
+            return search_result(rows)
+        return search_result([r for r in rows if r[field] == request.json()[param]])
+    return callback
+
+
+@pytest.fixture
+def opnsense_api(requests_mock):
+    requests_mock.get(f"{URL}/diagnostics/firewall/pf_states", json={'current': '42', 'limit': '1000'})
+    requests_mock.get(f"{URL}/firewall/alias/get_table_size", json={'used': 2, 'size': 100})
+    requests_mock.get(f"{URL}/core/firmware/status", json={'product_version': '25.1'})
+    requests_mock.post(f"{URL}/diagnostics/interface/get_vip_status", json=dict(search_result([{'interface': 'lan', 'vhid': '1', 'status': 'MASTER'}]), carp={'demotion': '0'}))
+    requests_mock.get(f"{URL}/routes/gateway/status", json={'items': [{'name': 'WAN_GW'}]})
+    requests_mock.post(f"{URL}/ipsec/connections/search_connection", json=json_callback(EXAMPLE_CONNECTIONS))
+    requests_mock.post(f"{URL}/ipsec/connections/search_child", json=json_callback(EXAMPLE_CHILDS, 'connection', 'connection'))
+    requests_mock.post(f"{URL}/ipsec/sessions/search_phase1", json=json_callback(EXAMPLE_PHASE1))
+    requests_mock.post(f"{URL}/ipsec/sessions/search_phase2", json=json_callback(EXAMPLE_PHASE2, 'ikeid', 'id'))
+    requests_mock.get(f"{URL}/unbound/diagnostics/stats", json={'status': 'ok'})
+    requests_mock.get(f"{URL}/core/snapshots/search", json=search_result([{'name': 'default'}]))
+    requests_mock.get(f"{URL}/trust/cert/search", json=search_result(EXAMPLE_CERTS))
+    return requests_mock
+
+
+def run_agent(capsys, *argv):
+    agent = AgentOpnSense()
+    agent.main(agent.parse_arguments(['-U', URL, '-k', 'key', '-s', 'secret', *argv]))
+    return without_stats(capsys.readouterr().out)
+
+
+def without_stats(output):
+    return re.sub(r'<<<opnsense_agent_stats:sep\(0\)>>>\n.*\n', '', output)
+
+
+def section_lines(output, name):
+    lines = output.split(f"<<<{name}:sep(0)>>>\n")[1].splitlines()
+    return list(takewhile(lambda line: not line.startswith('<<<'), lines))
+
+
+def test_agent_sections(opnsense_api, capsys):
+    output = run_agent(capsys, *ALL_PARTS)
+    assert [line for line in output.splitlines() if line.startswith('<<<')] == [
+        '<<<opnsense_pf_states:sep(0)>>>',
+        '<<<opnsense_alias_table:sep(0)>>>',
+        '<<<opnsense_firmware:sep(0)>>>',
+        '<<<opnsense_carp:sep(0)>>>',
+        '<<<opnsense_vip:sep(0)>>>',
+        '<<<opnsense_gateway:sep(0)>>>',
+        '<<<opnsense_ipsec:sep(0)>>>',
+        '<<<opnsense_ipsec_phase1:sep(0)>>>',
+        '<<<opnsense_ipsec_phase2:sep(0)>>>',
+        '<<<opnsense_unbound:sep(0)>>>',
+        '<<<opnsense_snapshot:sep(0)>>>',
+        '<<<sslcertificates:sep(0)>>>',
+        '<<<opnsense_agent:sep(0)>>>',
+    ]
+    assert '"file": "Web GUI"' in output
+    assert '"file": "User"' not in output
+    assert '"file": "Unused"' not in output
+
+
+@pytest.mark.parametrize('workers', ['1', '4'])
+def test_agent_stats(opnsense_api, capsys, workers):
+    agent = AgentOpnSense()
+    agent.main(agent.parse_arguments(['-U', URL, '-k', 'key', '-s', 'secret', '--workers', workers, '--vip', '--ipsec', '--unbound']))
+    stats = json.loads(section_lines(capsys.readouterr().out, 'opnsense_agent_stats')[0])
+    assert set(stats) == {'wall_time', 'cpu_time', 'sections', 'endpoints'}
+    assert stats['wall_time'] >= max(stats['sections'].values()) > 0
+    assert sorted(stats['sections']) == ['ipsec', 'unbound', 'vip']
+    assert {endpoint: (e['requests'], e['pages'], e['status']) for endpoint, e in stats['endpoints'].items()} == {
+        'diagnostics/interface/get_vip_status': (1, 1, {'200': 1}),
+        'ipsec/connections/search_connection': (1, 1, {'200': 1}),
+        'ipsec/connections/search_child': (2, 2, {'200': 2}),
+        'ipsec/sessions/search_phase1': (1, 1, {'200': 1}),
+        'ipsec/sessions/search_phase2': (2, 2, {'200': 2}),
+        'unbound/diagnostics/stats': (1, 0, {'200': 1}),
+    }
+    assert stats['endpoints']['unbound/diagnostics/stats']['bytes'] == len('{"status": "ok"}')
+
+
+@pytest.mark.parametrize('name', decoder.available_decoders())
+def test_osapi_invalid_utf8(requests_mock, monkeypatch, name):
+    monkeypatch.setattr(decoder, 'get_loads', lambda: decoder.available_decoders()[name])
+    requests_mock.get(f"{URL}/core/firmware/status", content=b'{"product_version": "25.1", "product_name": "OPN\xffsense"}')
+    api = OSAPI(URL, 'key', 'secret')
+    assert api.get('core', 'firmware', 'status') == {'product_version': '25.1', 'product_name': 'OPN\ufffdsense'}
+
+
+@pytest.mark.parametrize('name', decoder.available_decoders())
+def test_osapi_invalid_json(requests_mock, monkeypatch, name):
+    monkeypatch.setattr(decoder, 'get_loads', lambda: decoder.available_decoders()[name])
+    requests_mock.get(f"{URL}/core/firmware/status", content=b'{"product_version": "\xff')
+    api = OSAPI(URL, 'key', 'secret')
+    with pytest.raises(CannotRecover, match="Couldn't parse JSON"):
+        api.get('core', 'firmware', 'status')
+
+
+def test_osapi_stats_errors(requests_mock):
+    requests_mock.get(f"{URL}/unbound/diagnostics/stats", [{'status_code': 500}, {'exc': requests.exceptions.ConnectTimeout}])
+    api = OSAPI(URL, 'key', 'secret', timeout=5)
+    for _ in range(2):
+        with pytest.raises(CannotRecover):
+            api.get('unbound', 'diagnostics', 'stats')
+    assert api.stats['unbound/diagnostics/stats']['status'] == {'500': 1, 'error': 1}
+    assert api.stats['unbound/diagnostics/stats']['requests'] == 2
+
+
+@pytest.mark.parametrize('workers', ['2', '4', '16'])
+def test_agent_workers(opnsense_api, capsys, workers):
+    assert run_agent(capsys, '--workers', workers, *ALL_PARTS) == run_agent(capsys, *ALL_PARTS)
+
+
+@pytest.mark.parametrize('option, value', [('--workers', '0'), ('--workers', '-2'), ('--page-fanout', '0'), ('--profile-every', '0')])
+def test_agent_positive_arguments(option, value):
+    with pytest.raises(SystemExit):
+        AgentOpnSense().parse_arguments(['-U', URL, '-k', 'key', '-s', 'secret', option, value])
+
+
+def test_agent_workers_share_api(opnsense_api, capsys, monkeypatch):
+    threads = []
+
+    def spy(init):
+        def wrapper(self, *args, **kwargs):
+            threads.append((type(self).__name__, threading.current_thread()))
+            init(self, *args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(OSAPI, '__init__', spy(OSAPI.__init__))
+    monkeypatch.setattr(requests.Session, '__init__', spy(requests.Session.__init__))
+    run_agent(capsys, '--workers', '4', '--page-fanout', '2', *ALL_PARTS)
+    # The API client and its session are built once, before the workers start
+    assert threads == [('OSAPI', threading.main_thread()), ('Session', threading.main_thread())]
+
+
+@pytest.mark.parametrize('ipsec_child, childs, requests', [
+    ('connection', [['IPSec1 Child'], ['IPSec2 Child']], 3),
+    ('bulk', [['IPSec1 Child'], ['IPSec2 Child']], 2),
+    ('skip', [None, None], 1),
+])
+def test_agent_ipsec_child(opnsense_api, capsys, ipsec_child, childs, requests):
+    agent = AgentOpnSense()
+    agent.args = agent.parse_arguments(['-U', URL, '-k', 'key', '-s', 'secret', '--ipsec-child', ipsec_child])
+    connections = agent.api.getIpsecConnections
+    assert [[c['description'] for c in conn['child']] if 'child' in conn else None for conn in connections] == childs
+    assert opnsense_api.call_count == requests
+
+
+@pytest.mark.parametrize('ipsec_child', ['connection', 'bulk'])
+def test_agent_ipsec_child_same_description(opnsense_api, capsys, ipsec_child):
+    opnsense_api.post(f"{URL}/ipsec/connections/search_connection", json=json_callback([
+        {'uuid': 'conn-1', 'description': 'IPSec', 'enabled': '1'},
+        {'uuid': 'conn-2', 'description': 'IPSec', 'enabled': '1'},
+    ]))
+    agent = AgentOpnSense()
+    agent.args = agent.parse_arguments(['-U', URL, '-k', 'key', '-s', 'secret', '--ipsec-child', ipsec_child])
+    assert [[c['uuid'] for c in conn['child']] for conn in agent.api.getIpsecConnections] == [['child-1'], ['child-2']]
+
+
+@pytest.mark.parametrize('ipsec_phase2, requests', [
+    ('connection', 2),
+    ('bulk', 1),
+])
+def test_agent_ipsec_phase2(opnsense_api, capsys, ipsec_phase2, requests):
+    output = run_agent(capsys, '--ipsec', '--ipsec-child', 'skip', '--ipsec-phase2', ipsec_phase2)
+    assert section_lines(output, 'opnsense_ipsec_phase2') == [
+        '{"ikeid": "conn-1", "phase2desc": "IPSec1 Child", "state": "INSTALLED"}',
+        '{"ikeid": "conn-2", "phase2desc": "IPSec2 Child", "state": "INSTALLED"}',
+    ]
+    assert len(opnsense_api.request_history) == 2 + requests
+
+
+def test_agent_ipsec_phase2_order(opnsense_api, capsys):
+    phase2 = [
+        {'ikeid': 'conn-2', 'phase2desc': 'IPSec2 Child', 'state': 'INSTALLED'},
+        {'ikeid': 'conn-1', 'phase2desc': 'IPSec1 Child', 'state': 'INSTALLED'},
+        {'ikeid': 'conn-2', 'phase2desc': 'IPSec2 Child 2', 'state': 'INSTALLED'},
+    ]
+    opnsense_api.post(f"{URL}/ipsec/sessions/search_phase2", json=json_callback(phase2, 'ikeid', 'id'))
+    outputs = [
+        section_lines(run_agent(capsys, '--ipsec', '--ipsec-child', 'skip', '--ipsec-phase2', ipsec_phase2), 'opnsense_ipsec_phase2')
+        for ipsec_phase2 in ['connection', 'bulk']
+    ]
+    assert outputs[0] == outputs[1]
+    assert [json.loads(line)['phase2desc'] for line in outputs[1]] == ['IPSec1 Child', 'IPSec2 Child', 'IPSec2 Child 2']
+
+
+def test_agent_ipsec_phase1_down(opnsense_api, capsys):
+    opnsense_api.post(f"{URL}/ipsec/sessions/search_phase1", json=search_result([
+        {'name': 'conn-1', 'phase1desc': 'IPSec1', 'connected': False},
+        {'name': 'conn-2', 'phase1desc': 'IPSec2', 'connected': True},
+    ]))
+    output = run_agent(capsys, '--ipsec', '--ipsec-child', 'skip')
+    assert section_lines(output, 'opnsense_ipsec_phase2') == [
+        '{"ikeid": "conn-2", "phase2desc": "IPSec2 Child", "state": "INSTALLED"}',
+    ]
+    assert [r.json() for r in opnsense_api.request_history if r.path.endswith('/search_phase2')] == [{'id': 'conn-2', 'current': 1}]
+
+
+def paged_callback(rows, page_size):
+    def callback(request, context):
+        current = request.json()['current']
+        page = rows[(current - 1) * page_size:current * page_size]
+        return {'rows': page, 'rowCount': len(page), 'total': len(rows), 'current': current, 'carp': {'demotion': '0'}}
+    return callback
+
+
+def test_osapi_rate_limit(requests_mock):
+    requests_mock.get(f"{URL}/core/firmware/status", json={'product_version': '25.1'})
+    api = OSAPI(URL, 'key', 'secret', rate_limit=20, rate_burst=2)
+    start = time.monotonic()
+    for _ in range(6):
+        api.get('core', 'firmware', 'status')
+    assert 0.2 <= time.monotonic() - start < 0.6
+    assert requests_mock.call_count == 6
+
+
+def test_osapi_rate_limit_deadline(requests_mock):
+    requests_mock.get(f"{URL}/core/firmware/status", json={'product_version': '25.1'})
+    api = OSAPI(URL, 'key', 'secret', rate_limit=0.5)
+    token = DEADLINE.set(time.monotonic() + 1)
+    try:
+        api.get('core', 'firmware', 'status')
+        with pytest.raises(CannotRecover, match='Deadline exceeded waiting for the rate limit'):
+            api.get('core', 'firmware', 'status')
+    finally:
+        DEADLINE.reset(token)
+    assert requests_mock.call_count == 1
+    assert api.bucket.reserve() == pytest.approx(2, abs=0.1)
+
+
+@pytest.mark.parametrize('argv', [
+    ['--rate-limit', '0'],
+    ['--rate-limit', '5', '--rate-burst', '0'],
+    ['--max-in-flight', '0'],
+])
+def test_agent_limit_arguments(argv):
+    with pytest.raises(SystemExit):
+        AgentOpnSense().parse_arguments(['-U', URL, '-k', 'key', '-s', 'secret', *argv])
+
+
+@pytest.mark.parametrize('page_fanout', ['1', '3', '10'])
+@pytest.mark.parametrize('total', [0, 1, 9, 10, 25])
+def test_osapi_paginate(requests_mock, page_fanout, total):
+    vips = [{'interface': 'lan', 'vhid': str(i), 'status': 'MASTER'} for i in range(total)]
+    requests_mock.post(f"{URL}/diagnostics/interface/get_vip_status", json=paged_callback(vips, 10))
+    agent = AgentOpnSense()
+    agent.args = agent.parse_arguments(['-U', URL, '-k', 'key', '-s', 'secret', '--page-fanout', page_fanout])
+    assert agent.materialize(agent.sections('vip')) == [('opnsense_carp', {'demotion': '0'}), ('opnsense_vip', vips)]
+    assert requests_mock.call_count == max(1, (total + 9) // 10)
+
+
+@pytest.mark.parametrize('page_size, row_counts', [
+    ([], [None, None, None]),
+    (['--page-size', '10'], [10, 10, 10]),
+    (['--page-size', '-1'], [-1]),
+    (['--page-size', '10', '--page-size', 'get_vip_status=-1'], [-1]),
+    (['--page-size', 'search_phase2=-1'], [None, None, None]),
+])
+def test_osapi_page_size(requests_mock, page_size, row_counts):
+    vips = [{'interface': 'lan', 'vhid': str(i), 'status': 'MASTER'} for i in range(25)]
+
+    def callback(request, context):
+        row_count = request.json().get('rowCount', 10)
+        if row_count < 0:
+            return {'rows': vips, 'rowCount': len(vips), 'total': len(vips), 'current': 1, 'carp': {}}
+        return paged_callback(vips, row_count)(request, context)
+
+    requests_mock.post(f"{URL}/diagnostics/interface/get_vip_status", json=callback)
+    agent = AgentOpnSense()
+    agent.args = agent.parse_arguments(['-U', URL, '-k', 'key', '-s', 'secret', *page_size])
+    assert dict(agent.materialize(agent.sections('vip')))['opnsense_vip'] == vips
+    assert [r.json().get('rowCount') for r in requests_mock.request_history] == row_counts
+
+
+@pytest.mark.parametrize('page_size', ['0', '-7', 'search_phase2=0', 'bogus=5', 'ten'])
+def test_agent_page_size_arguments(page_size):
+    with pytest.raises(SystemExit):
+        AgentOpnSense().parse_arguments(['-U', URL, '-k', 'key', '-s', 'secret', '--page-size', page_size])
+
+
+@pytest.mark.parametrize('spool_size', [1024 * 1024, 100])
+def test_agent_complete_sections(requests_mock, capsys, monkeypatch, spool_size):
+    vips = [{'interface': 'lan', 'vhid': str(i), 'status': 'MASTER'} for i in range(25)]
+    written, spooled = [], []
+
+    def callback(request, context):
+        written.append(capsys.readouterr().out.count('"interface": "lan"'))
+        return paged_callback(vips, 10)(request, context)
+
+    def temporary_file(*args, **kwargs):
+        spooled.append(kwargs)
+        return temporary_file_orig(*args, **kwargs)
+
+    temporary_file_orig = tempfile.TemporaryFile
+    monkeypatch.setattr(tempfile, 'TemporaryFile', temporary_file)
+    monkeypatch.setattr(AgentOpnSense, 'SPOOL_SIZE', spool_size)
+    requests_mock.post(f"{URL}/diagnostics/interface/get_vip_status", json=callback)
+    output = run_agent(capsys, '--vip')
+    # Nothing is written before the part is complete, large parts are spooled to disk
+    assert written == [0, 0, 0]
+    assert len(section_lines(output, 'opnsense_vip')) == 25
+    assert bool(spooled) == (spool_size < 1000)
+
+
+@pytest.mark.parametrize('timeout, connect_timeout, deadline, result', [
+    (10, None, None, (10, 10)),
+    (10, 3, None, (3, 10)),
+    (None, 3, None, (3, None)),
+    (10, 3, 5, (3, 5)),
+    (10, 3, 2, (2, 2)),
+])
+def test_osapi_timeout(timeout, connect_timeout, deadline, result):
+    api = OSAPI(URL, 'key', 'secret', timeout=timeout, connect_timeout=connect_timeout)
+    token = DEADLINE.set(None if deadline is None else time.monotonic() + deadline)
+    try:
+        assert api._timeout('GET', URL) == pytest.approx(result, abs=0.1)
+    finally:
+        DEADLINE.reset(token)
+
+
+def test_osapi_deadline_exceeded(requests_mock):
+    api = OSAPI(URL, 'key', 'secret', timeout=10)
+    token = DEADLINE.set(time.monotonic())
+    try:
+        with pytest.raises(CannotRecover, match='Deadline exceeded'):
+            api.get('core', 'firmware', 'status')
+    finally:
+        DEADLINE.reset(token)
+    assert requests_mock.call_count == 0
+
+
+@pytest.mark.parametrize('workers', ['1', '4'])
+def test_agent_partial_output(opnsense_api, capsys, workers):
+    opnsense_api.get(f"{URL}/unbound/diagnostics/stats", status_code=500)
+    output = run_agent(capsys, '--workers', workers, *ALL_PARTS)
+    assert section_lines(output, 'opnsense_firmware') == ['{"product_version": "25.1"}']
+    assert '<<<opnsense_unbound:sep(0)>>>' not in output
+    assert section_lines(output, 'opnsense_agent') == [
+        f'{{"errors": {{"unbound": "Request error 500 when trying to GET {URL}/unbound/diagnostics/stats"}}}}',
+    ]
+
+
+@pytest.mark.parametrize('workers', ['1', '4'])
+@pytest.mark.parametrize('page_fanout', ['1', '4'])
+def test_agent_partial_output_later_page(requests_mock, capsys, workers, page_fanout):
+    vips = [{'interface': 'lan', 'vhid': str(i), 'status': 'MASTER'} for i in range(30)]
+    requests_mock.get(f"{URL}/core/firmware/status", json={'product_version': '25.1'})
+
+    def callback(request, context):
+        if request.json()['current'] == 2:
+            context.status_code = 500
+            return {}
+        return paged_callback(vips, 10)(request, context)
+
+    requests_mock.post(f"{URL}/diagnostics/interface/get_vip_status", json=callback)
+    output = run_agent(capsys, '--workers', workers, '--page-fanout', page_fanout, '--firmware', '--vip')
+    assert section_lines(output, 'opnsense_firmware') == ['{"product_version": "25.1"}']
+    assert '<<<opnsense_carp:sep(0)>>>' not in output
+    assert '<<<opnsense_vip:sep(0)>>>' not in output
+    assert list(json.loads(section_lines(output, 'opnsense_agent')[0])['errors']) == ['vip']
+
+
+def test_agent_section_timeout(opnsense_api, capsys):
+    output = run_agent(capsys, '--section-timeout', 'unbound=0', '--firmware', '--unbound')
+    assert section_lines(output, 'opnsense_firmware') == ['{"product_version": "25.1"}']
+    assert 'Deadline exceeded before trying to GET' in section_lines(output, 'opnsense_agent')[0]
+
+
+@pytest.mark.parametrize('option, value', [
+    ('--section-timeout', 'unbound=-1'),
+    ('--section-timeout', 'bogus=5'),
+    ('--section-interval', 'firmware=-60'),
+    ('--section-interval', 'firmware=nan'),
+])
+def test_agent_section_seconds_arguments(option, value):
+    with pytest.raises(SystemExit):
+        AgentOpnSense().parse_arguments(['-U', URL, '-k', 'key', '-s', 'secret', option, value])
+
+
+def test_agent_deadline(opnsense_api, capsys):
+    def stalled(request, context):
+        time.sleep(1)
+        return {'status': 'ok'}
+
+    opnsense_api.get(f"{URL}/unbound/diagnostics/stats", json=stalled)
+    start = time.monotonic()
+    output = run_agent(capsys, '--workers', '2', '--deadline', '0.2', '--firmware', '--unbound')
+    assert time.monotonic() - start < 0.8
+    assert section_lines(output, 'opnsense_firmware') == ['{"product_version": "25.1"}']
+    assert section_lines(output, 'opnsense_agent') == ['{"errors": {"unbound": "Deadline of 0.2s exceeded"}}']
+
+
+def test_agent_all_failed(opnsense_api, capsys):
+    opnsense_api.get(f"{URL}/core/firmware/status", status_code=401)
+    with pytest.raises(CannotRecover, match='Could not authenticate'):
+        run_agent(capsys, '--firmware')
+
+
+def test_agent_cache_ttl(opnsense_api, capsys, tmp_path):
+    cache = ['--cache-dir', str(tmp_path), '--cache-ttl', 'firmware=60']
+    first = run_agent(capsys, *cache, '--firmware', '--unbound')
+    second = run_agent(capsys, *cache, '--firmware', '--unbound')
+    assert first == second
+    assert [r.path for r in opnsense_api.request_history] == [
+        '/api/core/firmware/status',
+        '/api/unbound/diagnostics/stats',
+        '/api/unbound/diagnostics/stats',
+    ]
+
+
+def test_osapi_cache_credentials(requests_mock, tmp_path):
+    requests_mock.get(f"{URL}/core/firmware/status", json={'product_version': '25.1'})
+    cache, cache_ttl = JSONCache(tmp_path), {'core/firmware/status': 60}
+    for secret in ['secret', 'other', 'secret']:
+        OSAPI(URL, 'key', secret, cache=cache, cache_ttl=cache_ttl).get('core', 'firmware', 'status')
+    # Other credentials for the same URL do not read the cached response
+    assert requests_mock.call_count == 2
+
+
+@pytest.mark.parametrize('page_fanout', [1, 4])
+def test_osapi_cache_search(requests_mock, tmp_path, page_fanout):
+    connections = [{'uuid': str(i), 'enabled': '1'} for i in range(25)]
+    requests_mock.post(f"{URL}/ipsec/connections/search_connection", json=paged_callback(connections, 10))
+    cache, cache_ttl = JSONCache(tmp_path), {'ipsec/connections/search_connection': 60}
+    for _ in range(2):
+        api = OSAPI(URL, 'key', 'secret', cache=cache, cache_ttl=cache_ttl, page_size={None: 10}, page_fanout=page_fanout)
+        assert list(api.search('ipsec', 'connections', 'search_connection')) == connections
+    # All pages of a search are cached together and expire together
+    assert requests_mock.call_count == 3
+    assert len(list(tmp_path.iterdir())) == 1
+    assert api.stats['ipsec/connections/search_connection']['cached'] == 1
+
+
+@pytest.mark.parametrize('workers', ['1', '4'])
+def test_agent_section_interval(opnsense_api, capsys, tmp_path, workers):
+    cache = ['--workers', workers, '--cache-dir', str(tmp_path), '--section-interval', 'firmware=3600']
+    first = run_agent(capsys, *cache, '--firmware', '--unbound')
+    second = run_agent(capsys, *cache, '--firmware', '--unbound')
+    assert first == second
+    header = [line for line in first.splitlines() if line.startswith('<<<opnsense_firmware')][0]
+    timestamp = int(header.split('cached(')[1].split(',')[0])
+    assert header == f"<<<opnsense_firmware:cached({timestamp},3600):sep(0)>>>"
+    assert time.time() - 5 < timestamp <= time.time()
+    assert section_lines(first, f"opnsense_firmware:cached({timestamp},3600)") == ['{"product_version": "25.1"}']
+    assert sorted(r.path for r in opnsense_api.request_history) == [
+        '/api/core/firmware/status',
+        '/api/unbound/diagnostics/stats',
+        '/api/unbound/diagnostics/stats',
+    ]
+
+
+def test_agent_collect(requests_mock, capsys, tmp_path):
+    requests_mock.get('https://fw1.local/api/core/firmware/status', json={'product_version': '25.1'})
+    requests_mock.get('https://fw1.local/api/unbound/diagnostics/stats', json={'status': 'ok'})
+    requests_mock.get('https://fw2.local/api/core/firmware/status', status_code=401)
+    hosts = tmp_path / 'hosts.json'
+    hosts.write_text(json.dumps([
+        {'host': 'fw1', 'url': 'https://fw1.local/api/', 'key': 'key1', 'secret': 'secret1', 'args': ['--unbound']},
+        {'host': 'fw2', 'url': 'https://fw2.local/api/', 'key': 'key2', 'secret': 'secret2'},
+    ]))
+    agent = AgentOpnSense()
+    agent.main(agent.parse_arguments(['--collect', str(hosts), '--workers', '2', '--firmware']))
+    output = without_stats(capsys.readouterr().out)
+    blocks = sorted(block for block in output.split('<<<<>>>>\n') if block)
+    assert blocks == [
+        '<<<<fw1>>>>\n'
+        '<<<opnsense_firmware:sep(0)>>>\n{"product_version": "25.1"}\n'
+        '<<<opnsense_unbound:sep(0)>>>\n{"status": "ok"}\n'
+        '<<<opnsense_agent:sep(0)>>>\n{"errors": {}}\n',
+        '<<<<fw2>>>>\n'
+        '<<<opnsense_agent:sep(0)>>>\n'
+        '{"errors": {"firmware": "Could not authenticate to https://fw2.local/api/core/firmware/status. Key or secret is incorrect."}}\n',
+    ]
+    assert {r.headers['Authorization'] for r in requests_mock.request_history if r.hostname == 'fw1.local'} == {'Basic a2V5MTpzZWNyZXQx'}
+
+
+def unexpected_hosts(requests_mock, tmp_path):
+    requests_mock.get('https://fw1.local/api/routes/gateway/status', json={'items': [{'name': 'WAN_GW'}]})
+    requests_mock.get('https://fw2.local/api/routes/gateway/status', json={'unexpected': 1})
+    hosts = tmp_path / 'hosts.json'
+    hosts.write_text(json.dumps([
+        {'host': 'fw1', 'url': 'https://fw1.local/api/', 'key': 'key1', 'secret': 'secret1'},
+        {'host': 'fw2', 'url': 'https://fw2.local/api/', 'key': 'key2', 'secret': 'secret2'},
+    ]))
+    return hosts
+
+
+def test_agent_collect_unexpected_error(requests_mock, capsys, tmp_path):
+    hosts = unexpected_hosts(requests_mock, tmp_path)
+    agent = AgentOpnSense()
+    agent.main(agent.parse_arguments(['--collect', str(hosts), '--workers', '2', '--gateway']))
+    blocks = {block.split('\n')[0]: block for block in capsys.readouterr().out.split('<<<<>>>>\n') if block}
+    assert section_lines(blocks['<<<<fw1>>>>'], 'opnsense_gateway') == ['{"name": "WAN_GW"}']
+    assert section_lines(blocks['<<<<fw2>>>>'], 'opnsense_agent') == ['{"errors": {"agent": "\'items\'"}}']
+    assert json.loads(section_lines(blocks['<<<<fw2>>>>'], 'opnsense_agent_stats')[0])['wall_time'] >= 0
+
+
+def test_agent_daemon_cycle_unexpected_error(requests_mock, tmp_path):
+    hosts = unexpected_hosts(requests_mock, tmp_path)
+    agent = AgentOpnSense()
+    agent.args = agent.parse_arguments(['--collect', str(hosts), '--daemon', str(tmp_path / 'agent.sock'), '--gateway'])
+    outputs = {}
+    agent.daemon_cycle(outputs, {})
+    assert sorted(outputs) == ['fw1', 'fw2']
+    assert section_lines(outputs['fw2'][1], 'opnsense_agent') == ['{"errors": {"agent": "\'items\'"}}']
+
+
+def test_osapi_session_adapter(monkeypatch):
+    closed = []
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, 'close', lambda self: closed.append(self))
+    session = requests.Session()
+    adapter = OSAPI(URL, 'key', 'secret', pool_size=4, page_fanout=4, session=session)._cli.adapters['https://']
+    assert adapter._pool_maxsize == 16
+    # A new OSAPI of the next daemon cycle keeps the adapter of the session
+    assert OSAPI(URL, 'key', 'secret', pool_size=4, page_fanout=4, session=session)._cli.adapters['https://'] is adapter
+    assert adapter not in closed
+
+    assert OSAPI(URL, 'key', 'secret', session=session)._cli.adapters['https://'] is not adapter
+    assert adapter in closed
+
+
+@pytest.mark.parametrize('bad_host', [
+    {'host': 'fw2', 'url': 'https://fw2.local/api/', 'key': 'key2', 'secret': 'secret2', 'args': ['--bogus']},
+    {'host': 'fw2', 'url': 'https://fw2.local/api/', 'key': 'key2', 'secret': 'secret2', 'args': ['--workers', '0']},
+    {'host': 'fw2', 'url': 'https://fw2.local/api/', 'key': 'key2', 'secret': 'secret2', 'args': ['--ipsec-child', 'some']},
+    {'host': 'fw2', 'url': 'https://fw2.local/api/', 'key': 'key2', 'secret': 'secret2', 'args': ['--rate-limit', '-1']},
+    {'host': 'fw2', 'url': 'https://fw2.local/api/', 'key': 'key2', 'secret': 'secret2', 'args': '--unbound'},
+    {'host': 'fw2', 'url': 'https://fw2.local/api/'},
+    'fw2',
+])
+def test_agent_daemon_cycle_bad_host(requests_mock, caplog, tmp_path, bad_host):
+    requests_mock.get('https://fw1.local/api/core/firmware/status', json={'product_version': '25.1'})
+    hosts = tmp_path / 'hosts.json'
+    hosts.write_text(json.dumps([
+        {'host': 'fw1', 'url': 'https://fw1.local/api/', 'key': 'key1', 'secret': 'secret1'},
+        bad_host,
+    ]))
+    agent = AgentOpnSense()
+    agent.args = agent.parse_arguments(['--collect', str(hosts), '--daemon', str(tmp_path / 'agent.sock'), '--firmware'])
+    outputs = {}
+    agent.daemon_cycle(outputs, {})
+    # The bad host is logged and skipped, the other hosts are still collected
+    assert list(outputs) == ['fw1']
+    assert 'Skipping invalid host' in caplog.text
+
+
+def test_agent_arguments_required(capsys):
+    with pytest.raises(SystemExit):
+        AgentOpnSense().parse_arguments(['--firmware'])
+
+
+def test_agent_daemon_cycle(requests_mock, capsys, tmp_path):
+    requests_mock.get('https://fw1.local/api/core/firmware/status', json={'product_version': '25.1'})
+    hosts = tmp_path / 'hosts.json'
+    hosts.write_text(json.dumps([
+        {'host': 'fw1', 'url': 'https://fw1.local/api/', 'key': 'key1', 'secret': 'secret1'},
+    ]))
+    agent = AgentOpnSense()
+    agent.args = agent.parse_arguments(['--collect', str(hosts), '--daemon', str(tmp_path / 'agent.sock'), '--firmware'])
+    outputs, sessions = {}, {}
+    agent.daemon_cycle(outputs, sessions)
+    agent.daemon_cycle(outputs, sessions)
+    assert list(outputs) == ['fw1']
+    assert without_stats(outputs['fw1'][1]) == '<<<opnsense_firmware:sep(0)>>>\n{"product_version": "25.1"}\n<<<opnsense_agent:sep(0)>>>\n{"errors": {}}\n'
+    assert capsys.readouterr().out == ''
+    assert list(sessions) == ['fw1']
+
+    hosts.write_text('[]')
+    agent.daemon_cycle(outputs, sessions)
+    assert outputs == {}
+    assert sessions == {}
+
+
+def test_agent_lazy_imports():
+    # The Checkmk special agent modules are needed by every run and count as loaded by the agent
+    code = (
+        'import sys\n'
+        'loaded = set(sys.modules)\n'
+        'from cmk_addons.plugins.opnsense.lib.agent import AgentOpnSense\n'
+        'AgentOpnSense().parse_arguments(["-U", "http://fw/api", "-k", "key", "-s", "secret", "--firmware"])\n'
+        'print(" ".join(m for m in ("requests", "urllib3", "concurrent.futures", "socketserver", "orjson") if m in set(sys.modules) - loaded))\n'
+    )
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env, check=True)
+    assert proc.stdout == '\n'
+
+
+@pytest.mark.parametrize('profile_format, workers', [('pstats', '1'), ('collapsed', '1'), ('collapsed', '2')])
+def test_agent_profile(opnsense_api, capsys, tmp_path, profile_format, workers):
+    def slow_status(request, context):
+        time.sleep(0.05)
+        return {'status': 'ok'}
+    opnsense_api.get(f"{URL}/unbound/diagnostics/stats", json=slow_status)
+    output = run_agent(capsys, '--profile', '--profile-dir', str(tmp_path), '--profile-format', profile_format, '--workers', workers, '--firmware', '--unbound')
+    assert section_lines(output, 'opnsense_unbound') == ['{"status": "ok"}']
+    profiles = list(tmp_path.iterdir())
+    assert [p.name.split('-')[:2] for p in profiles] == [['agent_opnsense', 'opnsense.local']]
+    assert profiles[0].suffix == f".{profile_format}"
+    if profile_format == 'pstats':
+        stats = pstats.Stats(str(profiles[0]))
+        assert any(func[2] == 'section_unbound' for func in stats.stats)
+    else:
+        stacks = profiles[0].read_text().splitlines()
+        assert any('agent:AgentOpnSense.section_unbound' in line for line in stacks)
+        assert all(line.rsplit(' ', 1)[1].isdigit() for line in stacks)
+
+
+@pytest.mark.parametrize('profile_format', ['pstats', 'collapsed'])
+def test_agent_profile_unwritable(opnsense_api, capsys, tmp_path, caplog, profile_format):
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    output = run_agent(capsys, '--profile', '--profile-dir', str(blocker / 'profiles'), '--profile-format', profile_format, '--firmware')
+    assert section_lines(output, 'opnsense_firmware') == ['{"product_version": "25.1"}']
+    assert 'Could not write profile to' in caplog.text
+
+
+def test_agent_profile_every(opnsense_api, capsys, tmp_path, monkeypatch):
+    monkeypatch.setattr('random.randrange', lambda n: n - 1)
+    run_agent(capsys, '--profile', '--profile-dir', str(tmp_path), '--profile-every', '10', '--firmware')
+    assert list(tmp_path.iterdir()) == []
+    run_agent(capsys, '--profile', '--profile-dir', str(tmp_path), '--profile-every', '1', '--firmware')
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+@pytest.mark.parametrize('workers', ['1', '2'])
+def test_agent_trace(opnsense_api, capsys, tmp_path, workers):
+    opnsense_api.post(f"{URL}/diagnostics/interface/get_vip_status", json=paged_callback([{'interface': 'lan', 'vhid': str(i)} for i in range(5)], 2))
+    trace = tmp_path / 'trace.json'
+    run_agent(capsys, '--trace', str(trace), '--workers', workers, '--page-fanout', '2', '--vip', '--unbound')
+    events = json.loads(trace.read_text())['traceEvents']
+    spans = [e for e in events if e['ph'] == 'X']
+    assert sorted(e['name'] for e in spans if e['cat'] != 'request') == ['agent', 'section unbound', 'section vip']
+    assert sorted((e['name'], e['args']['page']) for e in spans if e['cat'] == 'request') == [
+        ('GET unbound/diagnostics/stats', None),
+        ('POST diagnostics/interface/get_vip_status', 1),
+        ('POST diagnostics/interface/get_vip_status', 2),
+        ('POST diagnostics/interface/get_vip_status', 3),
+    ]
+    agent = next(e for e in spans if e['name'] == 'agent')
+    assert all(agent['ts'] <= e['ts'] and e['ts'] + e['dur'] <= agent['ts'] + agent['dur'] + 1 for e in spans)
+    thread_names = {e['tid']: e['args']['name'] for e in events if e['name'] == 'thread_name'}
+    assert {e['tid'] for e in spans} <= set(thread_names)
+
+
+def test_agent_trace_unwritable(opnsense_api, capsys, tmp_path, caplog):
+    output = run_agent(capsys, '--trace', str(tmp_path / 'missing' / 'trace.json'), '--firmware')
+    assert section_lines(output, 'opnsense_firmware') == ['{"product_version": "25.1"}']
+    assert 'Could not write trace to' in caplog.text
+
+
+def test_agent_bench(opnsense_api, capsys):
+    opnsense_api.get(f"{URL}/unbound/diagnostics/stats", status_code=500)
+    opnsense_api.post(f"{URL}/diagnostics/interface/get_vip_status", json=paged_callback([{'interface': 'lan', 'vhid': str(i)} for i in range(5)], 2))
+    output = run_agent(capsys, '--bench', '3', '--cache-ttl', 'firmware=60', '--firmware', '--vip', '--unbound')
+    assert '<<<' not in output
+    lines = output.splitlines()
+    assert lines[0] == f"Benchmark of {URL} with 3 runs"
+    rows = {line.split()[0]: line.split()[1:] for line in lines[1:] if line}
+    assert rows['agent'][0] == '5.0'
+    assert rows['agent'][-1] == '3'
+    assert [rows[part][0] for part in ['firmware', 'unbound', 'vip']] == ['1.0', '1.0', '3.0']
+    assert [rows[part][-1] for part in ['firmware', 'unbound', 'vip']] == ['0', '3', '0']
+    endpoints = [line.split() for line in lines if line.startswith(('GET ', 'POST '))]
+    assert [(e[1], e[2], e[-1]) for e in endpoints] == [
+        ('core/firmware/status', '1.0', '0'),
+        ('unbound/diagnostics/stats', '1.0', '3'),
+        ('diagnostics/interface/get_vip_status', '3.0', '0'),
+    ]
+    assert len(opnsense_api.request_history) == 15
+
+
+@pytest.mark.parametrize('argv', [
+    ['--bench', '0'],
+    ['--bench', '2', '--collect', 'hosts.json'],
+])
+def test_agent_bench_arguments(argv):
+    with pytest.raises(SystemExit):
+        AgentOpnSense().parse_arguments(['-U', URL, '-k', 'key', '-s', 'secret', *argv])
+
+
+def fake_firewall(responses):
+    def send(adapter, request, **kwargs):
+        response = requests.Response()
+        response.status_code = 200 if request.path_url in responses else 404
+        response._content = json.dumps(responses.get(request.path_url, {})).encode()
+        response._content_consumed = True
+        response.elapsed = datetime.timedelta(seconds=0.05)
+        response.request = request
+        return response
+    return send
+
+
+def test_agent_max_in_flight(capsys, monkeypatch):
+    send = fake_firewall({'/api/core/firmware/status': {'product_version': '25.1'}})
+    in_flight, peak, lock = [0], [0], threading.Lock()
+
+    def slow_send(adapter, request, **kwargs):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.02)
+        with lock:
+            in_flight[0] -= 1
+        return send(adapter, request, **kwargs)
+
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, 'send', slow_send)
+    api = OSAPI(URL, 'key', 'secret', pool_size=8, max_in_flight=2)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: api.get('core', 'firmware', 'status'), range(16)))
+    assert results == [{'product_version': '25.1'}] * 16
+    assert peak[0] == 2
+
+
+def test_agent_record_replay(capsys, tmp_path, monkeypatch):
+    monkeypatch.setattr('requests.adapters.HTTPAdapter.send', fake_firewall({
+        '/api/core/firmware/status': {'product_version': '25.1'},
+        '/api/diagnostics/interface/get_vip_status': dict(search_result([{'interface': 'lan', 'vhid': '1', 'status': 'MASTER'}]), carp={'demotion': '0'}),
+    }))
+    recorded = run_agent(capsys, '--record', str(tmp_path), '--firmware', '--vip', '--unbound')
+    assert len(list(tmp_path.glob('*.json'))) == 3
+    assert 'unbound' in section_lines(recorded, 'opnsense_agent')[0]
+
+    monkeypatch.setattr('requests.adapters.HTTPAdapter.send', lambda *args, **kwargs: pytest.fail('network access'))
+    assert run_agent(capsys, '--replay', str(tmp_path), '--firmware', '--vip', '--unbound') == recorded
+    assert AgentOpnSense().parse_arguments(['--replay', str(tmp_path), '--firmware']).url == 'https://opnsense.replay/api/'
+
+
+def test_agent_replay_missing(capsys, tmp_path):
+    with pytest.raises(CannotRecover, match='No recorded response for GET /api/core/firmware/status'):
+        run_agent(capsys, '--replay', str(tmp_path), '--firmware')
+
+
+def test_agent_replay_latency(capsys, tmp_path, monkeypatch):
+    monkeypatch.setattr('requests.adapters.HTTPAdapter.send', fake_firewall({'/api/core/firmware/status': {'product_version': '25.1'}}))
+    run_agent(capsys, '--record', str(tmp_path), '--firmware')
+    start = time.monotonic()
+    run_agent(capsys, '--replay', str(tmp_path), '--replay-latency', '2', '--firmware')
+    assert time.monotonic() - start >= 0.1
+    with pytest.raises(CannotRecover, match='Read timeout after 0.05s'):
+        run_agent(capsys, '--replay', str(tmp_path), '--replay-latency', '2', '--timeout', '0.05', '--firmware')
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import time
+import pytest  # type: ignore[import]
+from cmk_addons.plugins.opnsense.lib.cache import JSONCache
+
+KEY = ('GET', 'https://opnsense.local/api/core/firmware/status', None)
+
+
+def test_cache_roundtrip(tmp_path):
+    cache = JSONCache(tmp_path / 'cache')
+    assert cache.get(*KEY, ttl=60) is None
+    cache.set(*KEY, data={'product_version': '25.1'})
+    assert cache.get(*KEY, ttl=60) == {'product_version': '25.1'}
+    assert cache.get('GET', 'https://other.local/api/core/firmware/status', None, ttl=60) is None
+    assert [p.name for p in (tmp_path / 'cache').iterdir() if p.name.startswith('.')] == []
+
+
+@pytest.mark.parametrize('age, ttl, result', [
+    (0, 60, {'a': 1}),
+    (30, 60, {'a': 1}),
+    (60, 60, None),
+    (-3600, 60, None),
+])
+def test_cache_ttl(tmp_path, age, ttl, result):
+    cache = JSONCache(tmp_path)
+    cache.set(*KEY, data={'a': 1}, timestamp=time.time() - age)
+    assert cache.get(*KEY, ttl=ttl) == result
+
+
+@pytest.mark.parametrize('content', [
+    '',
+    '{"timestamp": 1',
+    '[]',
+    '{"data": {}}',
+    '{"timestamp": "now", "data": {}}',
+])
+def test_cache_corrupt(tmp_path, content):
+    cache = JSONCache(tmp_path)
+    cache.path(*KEY).write_text(content)
+    assert cache.get(*KEY, ttl=60) is None
+    cache.set(*KEY, data={'a': 1})
+    assert cache.get(*KEY, ttl=60) == {'a': 1}
+
+
+def test_cache_unwritable(tmp_path):
+    (tmp_path / 'file').write_text('')
+    cache = JSONCache(tmp_path / 'file' / 'cache')
+    cache.set(*KEY, data={'a': 1})
+    assert cache.get(*KEY, ttl=60) is None
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+import pytest  # type: ignore[import]
+from cmk_addons.plugins.opnsense.lib.server import CollectorServer
+from cmk_addons.plugins.opnsense.lib.client import main
+
+AGENT = Path(__file__).resolve().parents[3] / 'libexec' / 'agent_opnsense'
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = CollectorServer(str(tmp_path / 'agent.sock'))
+    server.outputs['fw1'] = (time.time(), '<<<opnsense_agent:sep(0)>>>\n{"errors": {}}\n')
+    server.outputs['fw2'] = (time.time() - 3600, '<<<opnsense_agent:sep(0)>>>\n{"errors": {}}\n')
+    server.outputs['fw4'] = ('yesterday', '<<<opnsense_agent:sep(0)>>>\n{"errors": {}}\n')
+    with server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+
+
+@pytest.mark.parametrize('hostname, code, out, err', [
+    ('fw1', 0, '<<<opnsense_agent:sep(0)>>>\n{"errors": {}}\n', ''),
+    ('fw2', 1, '', 'Data of collector daemon for fw2 is 3600s old\n'),
+    ('fw3', 1, '', 'Collector daemon has no data for fw3\n'),
+    ('fw4', 1, '', 'Collector daemon sent invalid data for fw4\n'),
+])
+def test_client(server, capsys, hostname, code, out, err):
+    assert main(['--socket', server.server_address, '--hostname', hostname]) == code
+    assert capsys.readouterr() == (out, err)
+
+
+def test_client_site_relative(server, tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv('OMD_ROOT', str(tmp_path))
+    assert main(['--socket', 'agent.sock', '--hostname', 'fw1']) == 0
+    assert capsys.readouterr().out == '<<<opnsense_agent:sep(0)>>>\n{"errors": {}}\n'
+
+
+def test_client_no_daemon(tmp_path, capsys):
+    assert main(['--socket', str(tmp_path / 'missing.sock'), '--hostname', 'fw1']) == 1
+    assert capsys.readouterr().err.startswith(f"Could not read from collector daemon at {tmp_path / 'missing.sock'}: ")
+
+
+@pytest.mark.parametrize('socket_args', [['--socket', 'agent.sock'], ['--socket=agent.sock']])
+def test_agent_socket_client(server, tmp_path, socket_args):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path), OMD_ROOT=str(tmp_path))
+    proc = subprocess.run([sys.executable, str(AGENT), *socket_args, '--hostname', 'fw1'], capture_output=True, text=True, env=env)
+    assert (proc.returncode, proc.stdout) == (0, '<<<opnsense_agent:sep(0)>>>\n{"errors": {}}\n')
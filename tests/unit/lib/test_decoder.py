@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2024  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import json
+import pytest  # type: ignore[import]
+from cmk_addons.plugins.opnsense.lib import decoder
+
+
+@pytest.mark.parametrize('name', decoder.available_decoders())
+@pytest.mark.parametrize('document', [
+    '{"key": "value", "list": [1, 2.5, true, null], "nested": {"\\u00e4": "\\ud83d\\ude00"}}',
+    b'[{"vhid": "1", "status": "MASTER"}]',
+])
+def test_decoders(name, document):
+    assert decoder.available_decoders()[name](document) == json.loads(document)
+
+
+@pytest.mark.parametrize('name', decoder.available_decoders())
+def test_decoders_error(name):
+    with pytest.raises(decoder.JSONDecodeError):
+        decoder.available_decoders()[name]('{"key": ')
+
+
+def test_select_decoder_fallback(monkeypatch):
+    def missing():
+        raise ImportError('missing')
+    monkeypatch.setitem(decoder.DECODERS, 'orjson', missing)
+    assert decoder.select_decoder() is json.loads
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# Run time bounds of the agent against a misbehaving or overloaded
+# firewall. The stub of the benchmarks serves a synthetic firewall over
+# real sockets and injects the faults.
+
+import json
+import time
+import pytest  # type: ignore[import]
+from cmk.special_agents.v0_unstable.agent_common import CannotRecover
+from cmk_addons.plugins.opnsense.lib.agent import AgentOpnSense, DEADLINE, OSAPI
+from cmk_addons.plugins.opnsense.tests.benchmark import synthetic
+from cmk_addons.plugins.opnsense.tests.benchmark.opnsense_stub import OPNsenseStub
+
+ALL_PARTS = ['--firewall', '--firmware', '--vip', '--gateway', '--ipsec', '--unbound', '--snapshot', '--ssl']
+
+
+@pytest.fixture
+def stub():
+    with OPNsenseStub() as stub:
+        stub.add_firewall(synthetic.firewall(**synthetic.SCALES['small']))
+        yield stub
+
+
+class Clock:
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.monotonic() - self.start
+
+
+def run_agent(capsys, stub, *argv):
+    agent = AgentOpnSense()
+    with Clock() as clock:
+        agent.main(agent.parse_arguments(['-U', stub.url, '-k', 'key', '-s', 'secret', *argv]))
+    return clock.seconds, capsys.readouterr().out
+
+
+def within(bound):
+    # Scheduling and socket overhead allowed for a run bounded by bound seconds
+    return bound * 1.5 + 0.2
+
+
+def agent_errors(output):
+    return json.loads(output.split('<<<opnsense_agent:sep(0)>>>\n')[1].splitlines()[0])['errors']
+
+
+@pytest.mark.parametrize('fault, options, error, minimum, maximum', [
+    (None, {'latency': 0.3}, None, 0.3, 0.3),
+    ('stall', {}, 'Read timeout after 0.5s', 0.5, 0.5),
+    ('stall', {'latency': 0.2}, 'Read timeout after 0.5s', 0.5, 0.5),
+    ('reset', {}, 'Could not GET', 0, 0),
+    ('status', {'status': 502}, 'Request error 502', 0, 0),
+    ('status', {'status': 503, 'latency': 0.2}, 'Request error 503', 0.2, 0.2),
+    ('truncate', {}, "Couldn't parse JSON", 0, 0),
+    ('cut', {}, 'Could not read the response', 0, 0),
+    ('trickle', {'interval': 0.05}, 'Read timeout after 0.5s', 0.5, 0.5),
+])
+def test_osapi_request_fault(stub, fault, options, error, minimum, maximum):
+    stub.add_fault('core/firmware/status', fault, **options)
+    api = OSAPI(stub.url, 'key', 'secret', timeout=0.5)
+    with Clock() as clock:
+        if error is None:
+            assert api.request('GET', 'core', 'firmware', 'status')['product_version']
+        else:
+            with pytest.raises(CannotRecover, match=error):
+                api.request('GET', 'core', 'firmware', 'status')
+    assert minimum <= clock.seconds < within(maximum)
+    assert api.stats['core/firmware/status']['requests'] == 1
+
+
+@pytest.mark.parametrize('fault', ['stall', 'trickle'])
+def test_osapi_request_fault_deadline(stub, fault):
+    stub.add_fault('core/firmware/status', fault, interval=0.05)
+    api = OSAPI(stub.url, 'key', 'secret', timeout=10)
+    token = DEADLINE.set(time.monotonic() + 0.5)
+    try:
+        with Clock() as clock, pytest.raises(CannotRecover, match=r'Read timeout after 0\.\d+s'):
+            api.request('GET', 'core', 'firmware', 'status')
+    finally:
+        DEADLINE.reset(token)
+    assert clock.seconds < within(0.5)
+
+
+def test_osapi_paginate_fault(stub):
+    stub.add_fault('diagnostics/interface/get_vip_status', 'stall')
+    api = OSAPI(stub.url, 'key', 'secret', timeout=0.5, page_size={None: 2}, page_fanout=4)
+    with Clock() as clock, pytest.raises(CannotRecover, match='Read timeout'):
+        list(api.search('diagnostics', 'interface', 'get_vip_status'))
+    assert clock.seconds < within(0.5)
+
+
+@pytest.mark.parametrize('fault, options', [
+    ('stall', {}),
+    ('reset', {}),
+    ('status', {'status': 500}),
+    ('truncate', {}),
+    ('cut', {}),
+    ('trickle', {'interval': 0.05}),
+])
+@pytest.mark.parametrize('argv', [
+    [],
+    ['--workers', '4'],
+    ['--workers', '4', '--page-size', '2', '--page-fanout', '4'],
+])
+def test_agent_fault(stub, capsys, fault, options, argv):
+    # A failing endpoint costs its section at most one read timeout
+    stub.add_fault('unbound/diagnostics/stats', fault, **options)
+    seconds, output = run_agent(capsys, stub, '--timeout', '0.5', *argv, *ALL_PARTS)
+    assert seconds < within(0.5)
+    assert list(agent_errors(output)) == ['unbound']
+    assert '<<<opnsense_firmware:sep(0)>>>' in output
+
+
+@pytest.mark.parametrize('argv', [
+    [],
+    ['--workers', '4'],
+])
+def test_agent_stalled_timeout(stub, capsys, argv):
+    # Every part fails with its first request, serially or in parallel
+    for command in synthetic.firewall():
+        stub.add_fault(command, 'stall')
+    with Clock() as clock, pytest.raises(CannotRecover, match='Read timeout after 0.2s'):
+        run_agent(capsys, stub, '--timeout', '0.2', *argv, *ALL_PARTS)
+    bound = 0.2 * (len(ALL_PARTS) if not argv else 2)
+    assert clock.seconds < within(bound)
+
+
+@pytest.mark.parametrize('fault', ['stall', 'trickle'])
+@pytest.mark.parametrize('argv', [
+    [],
+    ['--workers', '4'],
+    ['--workers', '4', '--page-size', '2', '--page-fanout', '4'],
+])
+def test_agent_deadline_fault(stub, capsys, fault, argv):
+    # The deadline bounds the run no matter how many endpoints hang
+    for command in synthetic.firewall():
+        if command not in ['diagnostics/firewall/pf_states', 'firewall/alias/get_table_size']:
+            stub.add_fault(command, fault, interval=0.05)
+    seconds, output = run_agent(capsys, stub, '--timeout', '10', '--deadline', '1', *argv, *ALL_PARTS)
+    assert seconds < within(1)
+    assert '<<<opnsense_pf_states:sep(0)>>>' in output
+    assert sorted(agent_errors(output)) == sorted(p.removeprefix('--') for p in ALL_PARTS if p != '--firewall')
+
+
+def test_agent_section_timeout_fault(stub, capsys):
+    stub.add_fault('ipsec/connections/search_connection', 'stall')
+    stub.add_fault('unbound/diagnostics/stats', 'trickle', interval=0.05)
+    seconds, output = run_agent(capsys, stub, '--timeout', '10', '--section-timeout', 'ipsec=0.3', '--section-timeout', 'unbound=0.3', *ALL_PARTS)
+    assert seconds < within(0.6)
+    assert sorted(agent_errors(output)) == ['ipsec', 'unbound']
+
+
+def agent_stats(output):
+    return json.loads(output.split('<<<opnsense_agent_stats:sep(0)>>>\n')[1].splitlines()[0])
+
+
+def test_agent_adaptive_concurrency(capsys):
+    # A firewall with two PHP workers queues the requests above two
+    with OPNsenseStub(latency=0.05, workers=2) as stub:
+        stub.add_firewall(synthetic.firewall(vips=400))
+        _, output = run_agent(capsys, stub, '--vip', '--page-size', '10', '--page-fanout', '16', '--adaptive-concurrency')
+    concurrency = agent_stats(output)['concurrency']
+    assert concurrency['maximum'] == 16
+    assert concurrency['decreases'] >= 1
+    assert concurrency['limit'] < 16
+    assert stub.peak_in_flight < 16
+    assert agent_errors(output) == {}
+
+
+def test_agent_adaptive_concurrency_errors(stub, capsys):
+    stub.add_fault('diagnostics/interface/get_vip_status', 'status', status=503)
+    _, output = run_agent(capsys, stub, '--workers', '4', '--adaptive-concurrency', *ALL_PARTS)
+    assert agent_stats(output)['concurrency']['decreases'] == 1
+    assert list(agent_errors(output)) == ['vip']
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+#
+# checkmk_opnsense - Checkmk extension for OPNsense
+#
+# Copyright (C) 2025  Marius Rieder <marius.rieder@scs.ch>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import pytest  # type: ignore[import]
+from cmk_addons.plugins.opnsense.lib.throttle import AdaptiveLimit, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_burst():
+    clock = FakeClock()
+    bucket = TokenBucket(2, burst=3, clock=clock)
+    assert [bucket.reserve() for _ in range(5)] == [0, 0, 0, 0.5, 1.0]
+    clock.now += 1.0
+    assert bucket.reserve() == pytest.approx(0.5)
+    clock.now += 10
+    assert [bucket.reserve() for _ in range(4)] == [0, 0, 0, 0.5]
+
+
+def test_token_bucket_refund():
+    clock = FakeClock()
+    bucket = TokenBucket(1, clock=clock)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 1.0
+    bucket.refund()
+    assert bucket.reserve() == 1.0
+    bucket.refund()
+    bucket.refund()
+    assert bucket.reserve() == 0
+
+
+def test_adaptive_limit_slow_start():
+    clock = FakeClock()
+    limit = AdaptiveLimit(4, clock=clock)
+    assert limit.acquire(timeout=0)
+    assert not limit.acquire(timeout=0)
+    for _ in range(5):
+        limit.observe('core/firmware/status', clock(), 0.1, 200)
+    assert limit.limit == 4
+    assert all(limit.acquire(timeout=0) for _ in range(3))
+    assert not limit.acquire(timeout=0)
+    limit.release()
+    assert limit.acquire(timeout=0)
+    assert limit.summary() == {'limit': 4, 'maximum': 4, 'peak': 4, 'decreases': 0}
+
+
+@pytest.mark.parametrize('seconds, status', [
+    (0.1, 503),
+    (0.1, 429),
+    (0.1, None),
+    (0.5, 200),
+])
+def test_adaptive_limit_decrease(seconds, status):
+    clock = FakeClock()
+    limit = AdaptiveLimit(16, clock=clock)
+    for _ in range(7):
+        limit.observe('diagnostics/interface/get_vip_status', clock(), 0.1, 200)
+    assert limit.limit == 8
+    started = clock()
+    clock.now += 1
+    limit.observe('diagnostics/interface/get_vip_status', started, seconds, status)
+    assert limit.limit == 4
+    # Requests in flight before the decrease do not decrease it again
+    limit.observe('diagnostics/interface/get_vip_status', started, seconds, status)
+    assert limit.limit == 4
+    clock.now += 1
+    limit.observe('diagnostics/interface/get_vip_status', clock(), seconds, status)
+    assert limit.limit == 2
+    assert limit.decreases == 2
+
+
+def test_adaptive_limit_additive_increase():
+    clock = FakeClock()
+    limit = AdaptiveLimit(16, clock=clock)
+    limit.limit = 4.0
+    limit.observe('core/firmware/status', clock(), 0.1, 500)
+    assert limit.limit == 2
+    clock.now += 1
+    for _ in range(2):
+        limit.observe('core/firmware/status', clock(), 0.1, 200)
+    assert limit.limit == pytest.approx(2.9, abs=0.1)
+    # Endpoints are compared with their own fastest response
+    limit.observe('ipsec/connections/search_child', clock(), 2.0, 200)
+    assert limit.decreases == 1
+
+
+def test_adaptive_limit_fast_errors():
+    clock = FakeClock()
+    limit = AdaptiveLimit(16, clock=clock)
+    limit.observe('diagnostics/interface/get_vip_status', clock(), 0.002, 503)
+    for _ in range(40):
+        clock.now += 1
+        limit.observe('diagnostics/interface/get_vip_status', clock(), 0.05, 200)
+    assert limit.decreases == 1
+    assert limit.limit > 8
+
+
+def test_adaptive_limit_decay():
+    clock = FakeClock()
+    limit = AdaptiveLimit(16, clock=clock)
+    seconds = 0.01
+    for _ in range(330):
+        clock.now += 1
+        limit.observe('core/firmware/status', clock(), seconds, 200)
+        seconds *= 1.005
+    # The latency of the firewall drifted within tolerance, the fastest response followed it
+    assert limit.baseline['core/firmware/status'] == pytest.approx(0.05, rel=0.05)
+    assert limit.decreases == 0
+    assert limit.limit == 16
+
+
+def test_adaptive_limit_steady_overload():
+    clock = FakeClock()
+    limit = AdaptiveLimit(16, clock=clock)
+    for _ in range(10):
+        limit.observe('core/firmware/status', clock(), 0.1, 200)
+    # A steady overload still answering 200 does not become the baseline
+    for _ in range(200):
+        clock.now += 1
+        limit.observe('core/firmware/status', clock(), 0.3, 200)
+    assert limit.baseline['core/firmware/status'] == 0.1
+    assert limit.decreases == 200
+    assert limit.limit == 1